@@ -5,16 +5,36 @@ import vreg
 from dbdicom.dbd import DataBaseDicom
 
 
-def open(path:str) -> DataBaseDicom:
+def open(path:str, workers:int=1, refresh:bool=False, 
+         register_format:str=None, cache:int=None, 
+         disk_cache:bool=False, compact:bool=False) -> DataBaseDicom:
     """Open a DICOM database
 
     Args:
         path (str): path to the DICOM folder
+        workers (int, optional): number of parallel workers used when 
+            scanning the folder. Defaults to 1.
+        refresh (bool, optional): If True, the register is updated 
+            with any files that were added, modified or removed since 
+            it was last saved. Defaults to False.
+        register_format (str, optional): format of the register file 
+            saved in the DICOM folder, either 'npy', 'sqlite' or 
+            'pickle'. Defaults to None (the format of the saved 
+            register, or 'npy' if there is none).
+        cache (int, optional): memory budget in bytes for caching 
+            decoded slices between reads. Defaults to None (no cache).
+        disk_cache (bool, optional): If True, volumes and pixel data 
+            are cached in the DICOM folder and memory-mapped when they 
+            are read again. Defaults to False.
+        compact (bool, optional): If True, UIDs and descriptions in the 
+            register are stored as categoricals to save memory. 
+            Defaults to False.
 
     Returns:
         DataBaseDicom: database instance.
     """
-    return DataBaseDicom(path)
+    return DataBaseDicom(path, workers, refresh, register_format, cache, 
+                         disk_cache, compact)
 
 def print(path):
     """Print the contents of the DICOM folder
@@ -39,7 +59,8 @@ def summary(path) -> dict:
     return dbd.summary()
 
 
-def patients(path, name:str=None, contains:str=None, isin:list=None)->list:
+def patients(path, name:str=None, contains:str=None, isin:list=None, 
+             where:dict=None)->list:
     """Return a list of patients in the DICOM folder.
 
     Args:
@@ -51,15 +72,19 @@ def patients(path, name:str=None, contains:str=None, isin:list=None)->list:
             Defaults to None.
         isin (list, optional): List of PatientName values, to search 
             for patients whose name is in the list. Defaults to None.
+        where (dict, optional): only return patients with files where 
+            the register columns in the keys have one of the values in 
+            the values. Defaults to None.
 
     Returns:
         list: list of patients fulfilling the criteria.
     """
     dbd = open(path)
-    return dbd.patients(name, contains, isin)
+    return dbd.patients(name, contains, isin, where)
 
 
-def studies(entity:str | list, name:str=None, contains:str=None, isin:list=None)->list:
+def studies(entity:str | list, name:str=None, contains:str=None, isin:list=None, 
+            where:dict=None)->list:
     """Return a list of studies in the DICOM folder.
 
     Args:
@@ -73,23 +98,27 @@ def studies(entity:str | list, name:str=None, contains:str=None, isin:list=None)
             Defaults to None.
         isin (list, optional): List of StudyDescription values, to search 
             for studies whose description is in a list. Defaults to None.
+        where (dict, optional): only return studies with files where 
+            the register columns in the keys have one of the values in 
+            the values. Defaults to None.
 
     Returns:
         list: list of studies fulfilling the criteria.
     """
     if isinstance(entity, str): # path = folder
         dbd = open(entity)
-        return dbd.studies(entity, name, contains, isin)
+        return dbd.studies(entity, name, contains, isin, where)
     elif len(entity)==2: # path = patient
         dbd = open(entity[0])
-        return dbd.studies(entity, name, contains, isin)
+        return dbd.studies(entity, name, contains, isin, where)
     else:
         raise ValueError(
             "The path must be a folder or a 2-element list "
             "with a folder and a patient name."
         )
 
-def series(entity:str | list, name:str=None, contains:str=None, isin:list=None)->list:
+def series(entity:str | list, name:str=None, contains:str=None, isin:list=None, 
+           where:dict=None)->list:
     """Return a list of series in the DICOM folder.
 
     Args:
@@ -104,16 +133,19 @@ def series(entity:str | list, name:str=None, contains:str=None, isin:list=None)-
             Defaults to None.
         isin (list, optional): List of SeriesDescription values, to search 
             for series whose description is in a list. Defaults to None.
+        where (dict, optional): only return series with files where 
+            the register columns in the keys have one of the values in 
+            the values. Defaults to None.
 
     Returns:
         list: list of series fulfilling the criteria.
     """
     if isinstance(entity, str): # path = folder
         dbd = open(entity)
-        return dbd.series(entity, name, contains, isin)
+        return dbd.series(entity, name, contains, isin, where)
     elif len(entity) in [2,3]:
         dbd = open(entity[0])
-        return dbd.series(entity, name, contains, isin)
+        return dbd.series(entity, name, contains, isin, where)
     else:
         raise ValueError(
             "To retrieve a series, the entity must be a database, patient or study."
@@ -201,7 +233,8 @@ def to_nifti(series:list, file:str, dims:list=None, multislice=False):
     dbd = open(series[0])
     dbd.to_nifti(series, file, dims, multislice)
 
-def from_nifti(file:str, series:list, ref:list=None, multislice=False):
+def from_nifti(file:str, series:list, ref:list=None, multislice=False, 
+               dims:list=None, coords:list=None):
     """Create a DICOM series from a nifti file.
 
     Args:
@@ -211,9 +244,14 @@ def from_nifti(file:str, series:list, ref:list=None, multislice=False):
         multislice (bool, optional): Whether the data are to be written
             as multislice or not. In multislice data the voxel size 
             is written in the slice gap rather thaan the slice thickness. Defaults to False.
+        dims (list, optional): DICOM keywords of the non-spatial 
+            dimensions, for files with more than 3 dimensions. 
+            Defaults to None.
+        coords (list, optional): coordinates of the non-spatial 
+            dimensions. Defaults to None (index arrays).
     """
     dbd = open(series[0])
-    dbd.from_nifti(file, series, ref, multislice)
+    dbd.from_nifti(file, series, ref, multislice, dims, coords)
     dbd.close()
 
 def pixel_data(series:list, dims:list=None, include:list=None) -> tuple:
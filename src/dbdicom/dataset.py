@@ -13,6 +13,7 @@ import vreg
 
 import dbdicom.utils.image as image
 import dbdicom.utils.variables as variables
+import dbdicom.utils.parallel as parallel
 from dbdicom.sop_classes import (
     xray_angiographic_image,
     ct_image,
@@ -27,6 +28,16 @@ from dbdicom.sop_classes import (
 # This ensures that dates and times are read as TM, DT and DA classes
 pydicom.config.datetime_conversion = True
 
+# Values larger than this (in bytes) are not read by read_dataset() 
+# with defer_pixels=True until they are accessed.
+DEFER_SIZE = 4096
+
+# Transfer syntaxes where the pixel data can be read from the file as is
+UNCOMPRESSED = [
+    pydicom.uid.ExplicitVRLittleEndian,
+    pydicom.uid.ImplicitVRLittleEndian,
+]
+
 
 SOPCLASS = {
     '1.2.840.10008.5.1.4.1.1.4': 'MRImage',
@@ -48,10 +59,22 @@ SOPCLASSMODULE = {
 }
 
 
-def read_dataset(file):
+def read_dataset(file, defer_pixels=False):
+    """Read a DICOM file.
+
+    Args:
+        file (str): path to the file.
+        defer_pixels (bool, optional): If True, large values such as 
+            the pixel data are not read until they are needed. This 
+            allows pixel_data() to map the pixels straight from the 
+            file. Defaults to False.
 
+    Returns:
+        Dataset: the DICOM dataset.
+    """
+    defer_size = DEFER_SIZE if defer_pixels else None
     try:
-        ds = pydicom.dcmread(file)
+        ds = pydicom.dcmread(file, defer_size=defer_size)
         # ds = pydicom.dcmread(file, force=True) # more robust but hides corrupted data
     except Exception:
         raise FileNotFoundError('File not found')
@@ -59,6 +82,20 @@ def read_dataset(file):
     return ds
 
 
+def read_header(file, tags=None):
+    """Read the header of a DICOM file, without the pixel data.
+
+    Args:
+        file (str): path to the file.
+        tags (list, optional): only read these tags. Defaults to None
+            (all tags).
+
+    Returns:
+        Dataset: the DICOM dataset.
+    """
+    return pydicom.dcmread(file, stop_before_pixels=True, specific_tags=tags)
+
+
 def new_dataset(sop_class):
 
     if sop_class == 'MRImage':
@@ -221,13 +258,116 @@ def set_value(ds, tags, values):
 
 
 def write(ds, file, status=None):
-    # check if directory exists and create it if not
-    dir = os.path.dirname(file)
-    if not os.path.exists(dir):
-        os.makedirs(dir)
+    # create the directory if needed - files may be written in parallel
+    os.makedirs(os.path.dirname(file), exist_ok=True)
     ds.save_as(file, write_like_original=False)
 
 
+def copy_file(source, target, tags, values):
+    """Copy a DICOM file with new values for some of its data elements.
+
+    Only the header is parsed. The new data elements are encoded in 
+    the transfer syntax of the file, and all other bytes, including 
+    the pixel data, are copied from the source file as they are. 
+    Files that cannot be copied this way, such as those without a 
+    file meta header or with a deflated transfer syntax, are read 
+    in full and saved with the new values.
+
+    Args:
+        source (str): path to the file to copy.
+        target (str): path to the copy.
+        tags (list): DICOM keywords or (group, element) tuples.
+        values (list): new values of the tags.
+
+    Returns:
+        Dataset: the copy, with deferred pixel data.
+    """
+    ds = read_dataset(source, defer_pixels=True)
+    ts = ds.file_meta.get('TransferSyntaxUID')
+    meta_length = ds.file_meta.get('FileMetaInformationGroupLength')
+    if (ds.preamble is None or ts is None or meta_length is None or 
+            ts == pydicom.uid.DeflatedExplicitVRLittleEndian):
+        ds = read_dataset(source)
+        set_values(ds, tags, values)
+        write(ds, target)
+        return ds
+    implicit = ts == pydicom.uid.ImplicitVRLittleEndian
+    little = ts != pydicom.uid.ExplicitVRBigEndian
+
+    # Byte offset of each data element. The dataset starts after the 
+    # preamble, the prefix and the file meta information.
+    size = os.path.getsize(source)
+    offsets = _element_offsets(source, 132 + 12 + meta_length, implicit, little)
+
+    # Encode the new data elements in the transfer syntax of the file
+    new = set_values(Dataset(), list(tags), list(values))
+    encodings = ds.get('SpecificCharacterSet')
+    encoded = {}
+    for elem in new:
+        fp = pydicom.filebase.DicomBytesIO()
+        fp.is_little_endian = little
+        fp.is_implicit_VR = implicit
+        pydicom.filewriter.write_data_element(fp, elem, encodings)
+        encoded[elem.tag] = fp.getvalue()
+
+    # Alternate the new elements with byte ranges of the source file. 
+    # Elements set to None are left out.
+    removed = {pydicom.tag.Tag(t) for t, v in zip(tags, values) if v is None}
+    source_tags = [t for t in offsets if t not in removed]
+    ends = [offsets[t] for t in list(offsets)[1:]] + [size]
+    ranges = dict(zip(offsets, zip(offsets.values(), ends)))
+    pieces = []
+    for tag in sorted(set(source_tags) | set(encoded)):
+        if tag in encoded:
+            pieces.append(encoded[tag])
+        elif pieces and isinstance(pieces[-1], tuple) and pieces[-1][1] == ranges[tag][0]:
+            pieces[-1] = (pieces[-1][0], ranges[tag][1])
+        else:
+            pieces.append(ranges[tag])
+
+    file_meta = pydicom.dataset.FileMetaDataset(
+        {t: e for t, e in ds.file_meta.items() if t != 0x00020000})
+    if 'SOPInstanceUID' in new:
+        file_meta.MediaStorageSOPInstanceUID = new.SOPInstanceUID
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        dst.write(ds.preamble + b'DICM')
+        meta = pydicom.filebase.DicomBytesIO()
+        pydicom.filewriter.write_file_meta_info(meta, file_meta)
+        dst.write(meta.getvalue())
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                dst.write(piece)
+            else:
+                _copy_bytes(src, dst, *piece)
+    return set_values(ds, tags, values)
+
+
+def _element_offsets(file, start, implicit, little):
+    # Byte offsets of the top-level data elements in a file. Large 
+    # values are skipped, and each element starts where the previous 
+    # one ends.
+    offsets = {}
+    with open(file, 'rb') as fp:
+        fp.seek(start)
+        elems = pydicom.filereader.data_element_generator(
+            fp, implicit, little, defer_size=DEFER_SIZE)
+        for elem in elems:
+            offsets[elem.tag] = start
+            start = fp.tell()
+    return offsets
+
+
+def _copy_bytes(src, dst, start, end, chunksize=2**20):
+    src.seek(start)
+    while start < end:
+        chunk = src.read(min(chunksize, end - start))
+        if not chunk:
+            break
+        dst.write(chunk)
+        start += len(chunk)
+
+
 def codify(source_file, save_file, **kwargs):
     str = code_file(source_file, **kwargs)
     file = open(save_file, "w")
@@ -263,16 +403,52 @@ def read_data(files, tags, path=None, images_only=False):
 
 
 
-def read_dataframe(files, tags, path=None, images_only=False):
+def read_dataframe(files, tags, path=None, images_only=False, 
+                   workers=1, processes=True):
+    """Read the values of tags in a list of files.
+
+    Args:
+        files (list): files to read.
+        tags (list): tags to read for each file.
+        path (str, optional): If provided, the index of the result 
+            are file paths relative to path. Defaults to None.
+        images_only (bool, optional): Only include files with pixel 
+            data. Defaults to False.
+        workers (int, optional): Number of workers reading the files 
+            in parallel. Defaults to 1.
+        processes (bool, optional): If True, the workers are separate 
+            processes, otherwise threads. Defaults to True.
+
+    Returns:
+        pd.DataFrame: one row per DICOM file, in the order of files.
+    """
     if np.isscalar(files):
         files = [files]
     if np.isscalar(tags):
         tags = [tags]
-    array = []
-    dicom_files = []
-    for i, file in tqdm(enumerate(files), desc='Reading DICOM folder'):
+    if workers is None or workers <= 1:
+        files = tqdm(files, desc='Reading DICOM folder')
+        rows = _read_rows(files, tags, path, images_only)
+    else:
+        rows = parallel.map_chunks(
+            _read_rows, list(files), tags, path, images_only, 
+            workers=workers, processes=processes, 
+            desc='Reading DICOM folder')
+    array = [r[1] for r in rows]
+    dicom_files = [r[0] for r in rows]
+    df = pd.DataFrame(array, index = dicom_files, columns = tags)
+    return df
+
+
+def _read_rows(files, tags, path=None, images_only=False):
+    # Worker for read_dataframe - returns a list of (index, row)
+    rows = []
+    specific_tags = tags + ['Rows'] + [
+        t for tag in tags for t in _DERIVED_FROM.get(tag, [])]
+    for file in files:
         try:
-            ds = pydicom.dcmread(file, force=True, specific_tags=tags+['Rows'])
+            ds = pydicom.dcmread(file, force=True, stop_before_pixels=True, 
+                                 specific_tags=specific_tags)
         except:
             pass
         else:
@@ -282,14 +458,12 @@ def read_dataframe(files, tags, path=None, images_only=False):
                         if not 'Rows' in ds:
                             continue
                     row = get_values(ds, tags)
-                    array.append(row)
                     if path is None:
                         index = file
                     else:
                         index = os.path.relpath(file, path)
-                    dicom_files.append(index) 
-    df = pd.DataFrame(array, index = dicom_files, columns = tags)
-    return df
+                    rows.append((index, row))
+    return rows
 
 
 def _add_new(ds, tag, value, VR='OW'):
@@ -350,6 +524,11 @@ def derive_data_element(ds, tag):
     # To be extended ad hoc with other tags that can be derived
 
 
+# Tags needed to derive a tag that is not in the dataset
+_DERIVED_FROM = {
+    'SliceLocation': ['ImageOrientationPatient', 'ImagePositionPatient'],
+}
+
 
 def format_value(value, VR=None, tag=None):
 
@@ -569,27 +748,108 @@ def set_affine(ds, affine, multislice=False):
 
 
 
-def pixel_data(ds):
+def pixel_data(ds, out=None):
+    """Rescaled pixel data of a dataset, in (column, row) order.
+
+    Uncompressed single-frame data are read straight from the file 
+    buffer, without decoding them through pydicom.
 
+    Args:
+        ds (Dataset): DICOM dataset.
+        out (numpy.ndarray, optional): float32 array of shape 
+            (Columns, Rows) to write the pixel data into. Defaults 
+            to None (a new array is created).
+
+    Returns:
+        numpy.ndarray: pixel data, or None if the dataset has none.
+    """
     try:
         mod = SOPCLASSMODULE[ds.SOPClassUID]
     except KeyError:
         raise ValueError(
             f"DICOM class {ds.SOPClassUID} is not currently supported."
         )
-    if hasattr(mod, 'pixel_data'):
-        return getattr(mod, 'pixel_data')(ds)
+    if hasattr(mod, 'pixel_data') and not hasattr(mod, 'rescale'):
+        array = getattr(mod, 'pixel_data')(ds)
+        if out is None:
+            return array
+        out[...] = array
+        return out
     
-    try:
-        array = ds.pixel_array
-    except:
+    array = pixel_view(ds)
+    if array is None:
+        try:
+            array = np.transpose(ds.pixel_array)
+        except:
+            return None
+    if out is None:
+        out = np.empty(array.shape, dtype=np.float32)
+    out[...] = array
+    getattr(mod, 'rescale', _rescale)(ds, out)
+    return out
+
+
+def pixel_view(ds):
+    """View on the stored pixel values of an uncompressed dataset.
+
+    For datasets read with defer_pixels=True, the pixel data are 
+    memory-mapped from the file, so no copy is held in memory.
+
+    Args:
+        ds (Dataset): DICOM dataset.
+
+    Returns:
+        numpy.ndarray: read-only array of stored values in (column, row) 
+        order, or None if the pixel data need to be decoded by pydicom.
+    """
+    file_meta = getattr(ds, 'file_meta', {})
+    if file_meta.get('TransferSyntaxUID') not in UNCOMPRESSED:
+        return None
+    if ds.get('SamplesPerPixel', 1) != 1:
+        return None
+    if ds.get('NumberOfFrames', 1) not in (1, None):
+        return None
+    elem = ds.get_item(0x7FE00010, keep_deferred=True) # PixelData
+    if elem is None:
         return None
-    array = array.astype(np.float32)
+    bits, stored = ds.get('BitsAllocated'), ds.get('BitsStored')
+    signed = ds.get('PixelRepresentation', 0) == 1
+    if bits not in (8, 16, 32) or stored is None or stored > bits:
+        return None
+    if signed and stored < bits:
+        # Leave the sign extension to pydicom
+        return None
+    dtype = np.dtype(('<i' if signed else '<u') + str(bits // 8))
+    shape = (ds.Rows, ds.Columns)
+    if isinstance(elem, pydicom.dataelem.RawDataElement):
+        length = elem.length
+    else:
+        # Pixel data set in memory, such as those of a frame
+        length = len(elem.value)
+    if length is None or length < shape[0] * shape[1] * dtype.itemsize:
+        return None
+
+    if elem.value is None: 
+        # Deferred: map the values from the file
+        if not isinstance(ds.filename, str):
+            return None
+        array = np.memmap(ds.filename, dtype=dtype, mode='r', 
+                          offset=elem.value_tell, shape=shape)
+    else:
+        array = np.frombuffer(elem.value, dtype=dtype, count=shape[0]*shape[1])
+        array = array.reshape(shape)
+    if stored < bits:
+        # Ignore the bits that are not used
+        array = array & dtype.type(2**stored - 1)
+    return array.T
+
+
+def _rescale(ds, array):
+    # Rescale a float32 array of stored pixel values in place
     slope = float(getattr(ds, 'RescaleSlope', 1)) 
     intercept = float(getattr(ds, 'RescaleIntercept', 0)) 
     array *= slope
     array += intercept
-    return np.transpose(array)
 
 
 def set_pixel_data(ds, array, value_range=None):
@@ -639,17 +899,273 @@ def set_volume(ds, volume:vreg.Volume3D, multislice=False):
     set_affine(ds, volume.affine, multislice)
     if volume.coords is not None:
         # All other dimensions should have size 1
-        coords = volume.coords.reshape((volume.coords.shape[0], -1))
-        for i, d in enumerate(volume.dims):
-            try:
-                set_values(ds, d, coords[i,0])
-            except KeyError:
-                raise ValueError(
-                    "Cannot write volume to DICOM. "
-                    f"Volume dimension {d} is not a recognized DICOM data-element. "
-                    f"Use Volume3D.set_dims() with proper DICOM keywords "
-                    "or (group, element) tags to change the dimensions."
-                )
+        check_dims(volume.dims)
+        for d, c in zip(volume.dims, volume.coords):
+            set_values(ds, d, np.asarray(c).reshape(-1)[0])
+
+
+def check_dims(dims):
+    """Raise an error if volume dimensions are not DICOM data elements"""
+    for d in dims:
+        try:
+            pydicom.datadict.dictionary_VR(pydicom.tag.Tag(d))
+        except (KeyError, ValueError):
+            raise ValueError(
+                "Cannot write volume to DICOM. "
+                f"Volume dimension {d} is not a recognized DICOM data-element. "
+                f"Use Volume3D.set_dims() with proper DICOM keywords "
+                "or (group, element) tags to change the dimensions."
+            )
+
+
+def compile_tags(tags):
+    """Resolve a list of tags once, to read them from many datasets.
+
+    Args:
+        tags (list): DICOM keywords or (group, element) tuples.
+
+    Returns:
+        list: a (tag, key, VR) tuple for each tag, where tag is the 
+        original tag, key the pydicom BaseTag and VR the value 
+        representation (or None if the tag is not in the dictionary).
+    """
+    compiled = []
+    for tag in tags:
+        key = pydicom.tag.Tag(tag)
+        try:
+            VR = pydicom.datadict.dictionary_VR(key)
+        except KeyError:
+            VR = None
+        compiled.append((tag, key, VR))
+    return compiled
+
+
+_GEOMETRY = compile_tags([
+    'ImageOrientationPatient', 
+    'ImagePositionPatient', 
+    'PixelSpacing', 
+    'SliceThickness',
+    'SpacingBetweenSlices',
+])
+
+
+def read_slice(ds, tags, multislice=False, out=None, pixels=True):
+    """Read tag values, affine and pixel data of a 2D dataset in one pass.
+
+    Args:
+        ds (Dataset): single-frame dataset.
+        tags (list): tags compiled with compile_tags().
+        multislice (bool, optional): If True, the slice spacing is 
+            taken from SpacingBetweenSlices rather than SliceThickness. 
+            Defaults to False.
+        out (numpy.ndarray, optional): float32 array to write the 
+            pixel data into. See pixel_data(). Defaults to None.
+        pixels (bool, optional): If False, the pixel data are not 
+            read and None is returned instead. Defaults to True.
+
+    Returns:
+        tuple: list of values, 4x4 affine and 2D pixel array. The 
+        affine is None if the dataset has no geometry.
+    """
+    iop, ipp, ps, thickness, spacing = _compiled_values(ds, _GEOMETRY)
+    values = _compiled_values(ds, tags)
+    for i, (tag, _, _) in enumerate(tags):
+        if values[i] is None and tag in ('SliceLocation', (0x0020, 0x1041)):
+            if iop is not None and ipp is not None:
+                values[i] = image.slice_location(iop, ipp)
+    slice_spacing = spacing if multislice else thickness
+    if None in (iop, ipp, ps, slice_spacing):
+        affine = None
+    else:
+        affine = image.affine_matrix(iop, ipp, ps, slice_spacing)
+    if not pixels:
+        return values, affine, None
+    return values, affine, pixel_data(ds, out)
+
+
+def _compiled_values(ds, tags):
+    values = []
+    for _, key, VR in tags:
+        elem = ds.get(key)
+        if elem is None:
+            values.append(None)
+        else:
+            values.append(to_set_type(elem.value, VR))
+    return values
+
+
+# Data elements that are set separately for each slice of a volume
+SLICE_TAGS = [
+    'SOPInstanceUID', 
+    'InstanceNumber',
+    'PixelRepresentation', 
+    'RescaleSlope', 
+    'RescaleIntercept', 
+    'Rows', 
+    'Columns', 
+    'PixelData',
+    'PixelSpacing', 
+    'SliceThickness', 
+    'SpacingBetweenSlices', 
+    'ImageOrientationPatient', 
+    'ImagePositionPatient', 
+    'SliceLocation',
+    (0x2005, 0x100E), # Philips Rescale Slope
+    (0x2005, 0x100D), # Philips Rescale Intercept
+]
+
+
+def copy_slice(ds, tags=()):
+    """Shallow copy of a dataset, to write a slice with the same header.
+
+    The copy shares its data elements with the original, except those 
+    in SLICE_TAGS and tags. These are left out of the copy, so they 
+    can be set on the copy without changing the original. This means 
+    many slices can be created from the same dataset at the same time.
+
+    Args:
+        ds (FileDataset): dataset with the shared header.
+        tags (list, optional): other tags to leave out. Defaults to ().
+
+    Returns:
+        FileDataset: the copy.
+    """
+    drop = {pydicom.tag.Tag(t) for t in SLICE_TAGS + list(tags)}
+    # Indexing converts raw data elements in the original, so this is 
+    # only done once for all copies.
+    elems = {tag: ds[tag] for tag in ds.keys() if tag not in drop}
+    file_meta = ds.file_meta
+    meta = {tag: elem for tag, elem in file_meta.items() if tag not in _SLICE_META}
+    sl = pydicom.dataset.FileDataset(
+        None, elems, preamble=ds.preamble, 
+        file_meta=pydicom.dataset.FileMetaDataset(meta),
+    )
+    sl.file_meta.MediaStorageSOPInstanceUID = None
+    return sl
+
+
+_SLICE_META = {
+    pydicom.tag.Tag('FileMetaInformationGroupLength'),
+    pydicom.tag.Tag('MediaStorageSOPInstanceUID'),
+}
+
+
+# Multi-frame images of these classes are split into images of 
+# another class. Other multi-frame images are split into images of 
+# the same class with a single frame.
+SINGLE_FRAME_CLASS = {
+    '1.2.840.10008.5.1.4.1.1.4.1': '1.2.840.10008.5.1.4.1.1.4', # Enhanced MR
+    '1.2.840.10008.5.1.4.1.1.2.1': '1.2.840.10008.5.1.4.1.1.2', # Enhanced CT
+}
+
+_FRAME_TAGS = {pydicom.tag.Tag(t) for t in [
+    'SOPClassUID',
+    'SOPInstanceUID', 
+    'InstanceNumber',
+    'NumberOfFrames',
+    'SharedFunctionalGroupsSequence',
+    'PerFrameFunctionalGroupsSequence',
+    'PixelData',
+]}
+
+_FRAME_META = _SLICE_META | {pydicom.tag.Tag('MediaStorageSOPClassUID')}
+
+
+def split_multiframe(ds):
+    """Split a multi-frame dataset into single-frame datasets.
+
+    The functional groups are flattened into the header of each frame, 
+    and the pixel data of each frame are taken from the multi-frame 
+    pixel data without decoding them. The frames share the data 
+    elements that are the same for all frames, so they can be written 
+    but should not be modified. Use copy_frame() to write a frame 
+    with new values. The SOPInstanceUID of each frame is derived from 
+    that of the dataset and the frame number, so it is the same each 
+    time the dataset is split.
+
+    Args:
+        ds (FileDataset): multi-frame dataset. If this is a header 
+            read without the pixel data, the frames have no pixel 
+            data either.
+
+    Returns:
+        list: a dataset for each frame.
+    """
+    nframes = int(ds.NumberOfFrames)
+    pixels = _frame_pixel_data(ds, nframes) if 'PixelData' in ds else None
+    if 'PerFrameFunctionalGroupsSequence' in ds:
+        elements = enhanced_mr_image.frame_elements(ds)
+    else:
+        elements = [[] for _ in range(nframes)]
+    sop_class = SINGLE_FRAME_CLASS.get(ds.SOPClassUID, ds.SOPClassUID)
+    number = int(ds.get('InstanceNumber') or 1)
+    header = {tag: ds[tag] for tag in ds.keys() if tag not in _FRAME_TAGS}
+    meta = {tag: elem for tag, elem in ds.file_meta.items() if tag not in _FRAME_META}
+    frames = []
+    for i in range(nframes):
+        elems = header | {elem.tag: elem for elem in elements[i]}
+        # The datasets keep the dictionaries they are created from
+        frame = pydicom.dataset.FileDataset(
+            None, elems, preamble=ds.preamble, 
+            file_meta=pydicom.dataset.FileMetaDataset(dict(meta)),
+        )
+        uid = pydicom.uid.generate_uid(entropy_srcs=[ds.SOPInstanceUID, str(i)])
+        frame.file_meta.MediaStorageSOPClassUID = sop_class
+        frame.file_meta.MediaStorageSOPInstanceUID = uid
+        frame.SOPClassUID = sop_class
+        frame.SOPInstanceUID = uid
+        frame.InstanceNumber = (number - 1) * nframes + i + 1
+        if sop_class == ds.SOPClassUID:
+            frame.NumberOfFrames = 1
+        if pixels is not None:
+            frame.add_new('PixelData', ds['PixelData'].VR, pixels[i])
+            # Encapsulated pixel data are written with undefined length
+            frame['PixelData'].is_undefined_length = ds['PixelData'].is_undefined_length
+        frames.append(frame)
+    return frames
+
+
+def copy_frame(frame, target, tags, values):
+    """Write a frame returned by split_multiframe() with new values.
+
+    The frame itself is not modified, so other frames that share its 
+    data elements are not affected.
+
+    Args:
+        frame (FileDataset): the frame.
+        target (str): path to the copy.
+        tags (list): DICOM keywords or (group, element) tuples.
+        values (list): new values of the tags.
+
+    Returns:
+        Dataset: the copy.
+    """
+    drop = {pydicom.tag.Tag(t) for t in tags}
+    elems = {tag: frame[tag] for tag in frame.keys() if tag not in drop}
+    ds = pydicom.dataset.FileDataset(
+        None, elems, preamble=frame.preamble, 
+        file_meta=pydicom.dataset.FileMetaDataset(dict(frame.file_meta)),
+    )
+    set_values(ds, list(tags), list(values))
+    if 'SOPInstanceUID' in ds:
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    write(ds, target)
+    return ds
+
+
+def _frame_pixel_data(ds, nframes):
+    # Pixel data of each frame, as they are saved in the dataset
+    if ds.file_meta.TransferSyntaxUID.is_encapsulated:
+        frames = pydicom.encaps.generate_frames(ds.PixelData, number_of_frames=nframes)
+        return [pydicom.encaps.encapsulate([f]) for f in frames]
+    if ds.BitsAllocated == 1:
+        # Frames of single bits do not start at a byte boundary
+        array = ds.pixel_array.reshape((nframes, -1))
+        return [pydicom.pixels.pack_bits(a) for a in array]
+    size = ds.Rows * ds.Columns * ds.SamplesPerPixel * ds.BitsAllocated // 8
+    if ds.PhotometricInterpretation == 'YBR_FULL_422':
+        size = size // 3 * 2
+    return [ds.PixelData[i*size:(i+1)*size] for i in range(nframes)]
 
 
 def image_type(ds):
@@ -1,4 +1,7 @@
 import os
+import copy
+import json
+import functools
 from datetime import datetime
 
 from tqdm import tqdm
@@ -9,54 +12,427 @@ from pydicom.dataset import Dataset
 
 import dbdicom.utils.arrays
 import dbdicom.utils.files as filetools
-import dbdicom.utils.dcm4che as dcm4che
+import dbdicom.utils.store as store
+import dbdicom.utils.parallel as parallel
+import dbdicom.utils.nifti as nifti
+from dbdicom.utils.cache import LRUCache, DiskCache
 import dbdicom.dataset as dbdataset
 import dbdicom.register as register
 import dbdicom.const as const
 
 
 
+def _read_slices(files, tags, multislice=False, workers=1, desc=None, 
+                 cache=None, path=None):
+    # Read tag values, affines and pixel data of single-frame files, 
+    # or frames of multi-frame files. The files are decoded in a 
+    # thread pool, and the pixel data are written straight into a 
+    # preallocated array of shape (files, x, y). If a cache is 
+    # provided, decoded slices are looked up by file, relative to the 
+    # database folder path, and size and modification time.
+    n = len(files)
+    values = [None] * n
+    affines = [None] * n
+
+    # Multi-frame files are read once and split into frames
+    keys = [register.split_key(f) for f in files]
+    frames = _split_frames(keys, workers)
+
+    def read_dataset(i):
+        file, frame = keys[i]
+        if frame is None:
+            return dbdataset.read_dataset(file, defer_pixels=True)
+        return frames[file][frame]
+
+    def read_slice(i, ds, out=None):
+        return _read_slice(files[i], ds, tags, multislice, out, cache, path)
+
+    def read(i):
+        ds = read_dataset(i)
+        if (ds.get('Columns'), ds.get('Rows')) != data.shape[1:]:
+            raise ValueError(
+                "Cannot read the slices into a single array. Not all "
+                "slices have the same dimensions."
+            )
+        values[i], affines[i], _ = read_slice(i, ds, data[i])
+
+    # Read the first file to allocate the array
+    values[0], affines[0], pixels = read_slice(0, read_dataset(0))
+    data = np.empty((n,) + pixels.shape, dtype=pixels.dtype)
+    data[0] = pixels
+    parallel.map_items(read, range(1, n), workers, desc)
+    return values, affines, data
+
+
+def _read_slice(file, ds, tags, multislice=False, out=None, cache=None, 
+                path=None):
+    # Read a slice with dbdataset.read_slice(). If a cache is provided,
+    # the pixel data are looked up by file, or frame, relative to the 
+    # database folder path, and the size and modification time of 
+    # the file.
+    if cache is None:
+        return dbdataset.read_slice(ds, tags, multislice, out)
+    key = file if path is None else os.path.relpath(file, path)
+    stat = os.stat(register.split_key(file)[0])
+    version = (stat.st_mtime_ns, stat.st_size)
+    pixels = cache.get(key, version)
+    if pixels is None:
+        v, a, pixels = dbdataset.read_slice(ds, tags, multislice, out)
+        cache.put(key, pixels, version)
+        return v, a, pixels
+    v, a, _ = dbdataset.read_slice(ds, tags, multislice, pixels=False)
+    if out is None:
+        return v, a, pixels
+    out[...] = pixels
+    return v, a, out
+
+
+def _read_geometry(files, tags, multislice=False, workers=1, desc=None):
+    # Read tag values and affines of single-frame files, or frames of 
+    # multi-frame files, from the headers only. Raises an error if 
+    # the slices do not all have the same dimensions.
+    keys = [register.split_key(f) for f in files]
+    frames = _split_frames(keys, workers, pixels=False)
+
+    def read(i):
+        file, frame = keys[i]
+        ds = dbdataset.read_header(file) if frame is None else frames[file][frame]
+        values, affine, _ = dbdataset.read_slice(ds, tags, multislice, pixels=False)
+        return values, affine, (ds.get('Columns'), ds.get('Rows'))
+
+    rows = parallel.map_items(read, range(len(files)), workers, desc)
+    if len(set(r[2] for r in rows)) > 1:
+        raise ValueError(
+            "Cannot read the slices into a single array. Not all "
+            "slices have the same dimensions."
+        )
+    return [r[0] for r in rows], [r[1] for r in rows], rows[0][2]
+
+
+def _stream_slices(files, workers=1, cache=None, path=None):
+    # Generate the pixel data of single-frame files, or frames of 
+    # multi-frame files, in order. The slices are decoded in batches 
+    # of one per worker, so only a few are in memory at a time, and 
+    # only the frames of the most recent multi-frame file are kept.
+    keys = [register.split_key(f) for f in files]
+    frames = {}
+    batch = max(1, workers or 1)
+
+    def read(i):
+        file, frame = keys[i]
+        if frame is None:
+            ds = dbdataset.read_dataset(file, defer_pixels=True)
+        else:
+            ds = frames[file][frame]
+        return _read_slice(files[i], ds, [], cache=cache, path=path)[2]
+
+    for start in range(0, len(files), batch):
+        items = range(start, min(start + batch, len(files)))
+        needed = dict.fromkeys(keys[i][0] for i in items if keys[i][1] is not None)
+        frames = {f: frames[f] if f in frames else _frames(f) for f in needed}
+        yield from parallel.map_items(read, items, workers)
+
+
+def _frames(file, pixels=True):
+    # Single-frame datasets with the frames of a multi-frame file. 
+    # Headers of recently split files are reused until the file changes.
+    if pixels:
+        return dbdataset.split_multiframe(dbdataset.read_dataset(file))
+    stat = os.stat(file)
+    return _frame_headers(file, stat.st_size, stat.st_mtime_ns)
+
+
+def _split_frames(keys, workers=1, pixels=True):
+    # Frames of the multi-frame files among a list of (file, frame) 
+    # keys, split once per file in a thread pool.
+    multiframe = list(dict.fromkeys(f for f, frame in keys if frame is not None))
+    if multiframe == []:
+        return {}
+    frames = parallel.map_items(
+        lambda f: _frames(f, pixels), multiframe, workers)
+    return dict(zip(multiframe, frames))
+
+
+@functools.lru_cache(maxsize=8)
+def _frame_headers(file, size, mtime):
+    # The size and modification time are only part of the cache key
+    return dbdataset.split_multiframe(dbdataset.read_header(file))
+
+
+def _frame_values(file, tags):
+    # Values of tags in each frame of a multi-frame file
+    return [dbdataset.get_values(f, tags) for f in _frames(file, pixels=False)]
+
+
+def _read_dataset(file):
+    # Dataset of a file, or of a frame of a multi-frame file
+    file, frame = register.split_key(file)
+    if frame is None:
+        return dbdataset.read_dataset(file)
+    return _frames(file)[frame]
+
+
+def _to_mesh(data, inds, shape):
+    # Reorder slices of shape (files, x, y) and return as a (x, y, ...) 
+    # view. The data are only copied if the order changes.
+    inds = inds.reshape(-1)
+    if np.any(inds != np.arange(inds.size)):
+        data = data[inds]
+    return np.moveaxis(data, 0, -1).reshape(data.shape[1:] + shape)
+
+
+def _volume_affine(affines, prec=2):
+    # Affine of a volume built from slices with affines of shape 
+    # (slices, frames, 4, 4), and the order of the slices along the 
+    # slice direction. This performs the same checks as vreg.join().
+    mat = np.around(affines[..., :3, :3], prec)
+    if not np.all(mat == mat[0, 0]):
+        raise ValueError(
+            "Slices with different orientations or voxel sizes cannot "
+            "be joined into a volume."
+        )
+    pos = affines[..., :3, 3]
+    if np.any(np.around(np.linalg.norm(pos - pos[:, :1], axis=-1), prec+1) > 0):
+        raise ValueError(
+            "Cannot build a single volume. Not all frames of a slice "
+            "are at the same position."
+        )
+    axis = affines[0, 0, :3, 2] / np.linalg.norm(affines[0, 0, :3, 2])
+    order = np.argsort(pos[:, 0] @ axis, kind='stable')
+    dz = np.diff(pos[order, 0], axis=0)
+    dist = np.linalg.norm(dz, axis=-1) - np.abs(dz @ axis)
+    if np.any(np.around(dist, prec) != 0):
+        raise ValueError(
+            "Cannot build a single volume. The slices are not "
+            "aligned along the slice direction."
+        )
+    return affines[order[0], 0], order
+
+
+def _volume_dims(dims):
+    # Dimensions of a volume, starting with the slice location
+    if dims is None:
+        dims = []
+    elif isinstance(dims, str):
+        dims = [dims]
+    else:
+        dims = list(dims)
+    return ['SliceLocation'] + dims
+
+
+def _volume_geometry(values, affines):
+    # Layout of a volume built from slices with given values of the 
+    # dimensions and affines. Returns the index of the slice at each 
+    # position of the volume, in an array of shape (z, ...), along 
+    # with the affine and the coordinates of the non-spatial 
+    # dimensions.
+    if any(a is None for a in affines):
+        raise ValueError(
+            "Cannot build a volume. Not all slices have a position "
+            "and orientation."
+        )
+    affines = np.stack(affines)
+
+    # Format as mesh
+    coords = np.stack(values, axis=-1)
+    coords, inds = dbdicom.utils.arrays.meshvals(coords)
+    shape = coords.shape[1:]
+
+    # Check that all slices have the same coordinates
+    c0 = coords[1:,0,...]
+    for k in range(coords.shape[1]-1):
+        if not np.array_equal(coords[1:,k+1,...], c0):
+            raise ValueError(
+                "Cannot build a single volume. Not all slices "
+                "have the same coordinates. \nIf you set " 
+                "firstslice=True, the coordinates of the lowest "
+                "slice will be assigned to the whole volume."     
+            )
+        
+    # Check the geometry
+    affines = affines[inds].reshape(shape + (4, 4))
+    affine, order = _volume_affine(affines.reshape((shape[0], -1, 4, 4)))
+    return inds.reshape(shape)[order], affine, c0
+
+
+# Module attributes cached for each entity: (level, UID column, attributes)
+MODULES = [
+    ('patient', 'PatientID', const.PATIENT_MODULE),
+    ('study', 'StudyInstanceUID', const.STUDY_MODULE),
+    ('series', 'SeriesInstanceUID', const.SERIES_MODULE),
+]
+
+
 class DataBaseDicom():
     """Class to read and write a DICOM folder.
 
     Args:
         path (str): path to the DICOM folder.
+        workers (int, optional): number of parallel workers used when 
+            scanning the folder and decoding pixel data. Defaults to 1.
+        refresh (bool, optional): If True, an existing register is 
+            updated on opening with any files that have been added, 
+            modified or removed since it was saved. Defaults to False.
+        cache (int, optional): memory budget in bytes for a cache of 
+            decoded slices, which is used by volume() and pixel_data() 
+            when the same files are read again. The cache is available 
+            as the attribute cache, with hit and miss counts. Defaults 
+            to None (no cache).
+        disk_cache (bool, optional): If True, arrays returned by 
+            volume() and pixel_data() are saved in a cache folder in 
+            the database, and read back memory-mapped when they are 
+            requested again. Entries of a series are removed when 
+            its files change. Defaults to False.
+        register_format (str, optional): format of the register file 
+            saved in the folder. Options are 'npy' (a folder with one 
+            file per column), 'sqlite' (an indexed SQLite database 
+            that other processes can query with 
+            dbdicom.utils.store.read) or 'pickle'. An SQLite register 
+            is only loaded into memory when the database is modified. 
+            Until then, lookups such as series() and unique() only 
+            read the rows and columns they need. A register saved 
+            in another format is converted on saving. Defaults to None, 
+            which keeps the format of the saved register, or uses 
+            'npy' if there is none.
+        compact (bool, optional): If True, the register is kept in 
+            memory with UIDs and descriptions as categoricals, which 
+            store each distinct value only once. This reduces the 
+            memory of large registers several times. Defaults to False.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, workers=1, refresh=False, register_format=None, 
+                 cache=None, disk_cache=False, compact=False):
 
         if not os.path.exists(path):
             os.makedirs(path)
         self.path = path
-
-        file = self._register_file()
-        if os.path.exists(file):
+        self.workers = workers
+        self.cache = None if cache is None else LRUCache(cache)
+        self.disk_cache = DiskCache(self._cache_folder()) if disk_cache else None
+        self.register_format = register_format
+        self.compact = compact
+        self._modules = {level: {} for level, _, _ in MODULES}
+        self._extra_columns = {} # column: files read
+        self._skipped = {} # file: (size, mtime) of files that are not images
+        self._register = None
+        self._hierarchy = None
+        self._unloaded = None # SQLite register that is not loaded yet
+
+        file = self._saved_register_file()
+        if self.register_format is None:
+            self.register_format = 'npy' if file is None else store.format_of(file)
+        if file is not None:
             try:
-                self.register = pd.read_pickle(file)
+                self._read_meta(file)
+                if (not refresh and self.register_format == 'sqlite' 
+                        and file == self._register_file()):
+                    # Queries read from the file until it is needed
+                    self._unloaded = file
+                else:
+                    self.register = store.read(file)
             except:
                 # If the file is corrupted, delete it and load again
-                os.remove(file)
+                store.remove(file)
                 self.read()
+            else:
+                if refresh:
+                    self.read()
         else:
             self.read()
 
 
-    def read(self):
+    @property
+    def register(self):
+        # An SQLite register is loaded when it is first needed. The 
+        # tree is kept as it was built from the same file.
+        if self._unloaded is not None:
+            file, tree, self._unloaded = self._unloaded, self._hierarchy, None
+            self.register = store.read(file)
+            self._hierarchy = tree
+        return self._register
+
+    @register.setter
+    def register(self, df):
+        # The tree is rebuilt from the new register when next needed
+        if self.compact:
+            df = register.compact(df)
+        else:
+            df = register.expand(df)
+        self._register = df
+        self._hierarchy = None
+
+
+    def read(self, workers=None, full=False):
         """Read the DICOM folder again
-        """
 
-        files = filetools.all_files(self.path)
-        self.register = dbdataset.read_dataframe(
-            files, 
-            register.COLUMNS + ['NumberOfFrames','SOPClassUID'], 
-            path=self.path, 
-            images_only = True)
-        self.register['removed'] = False
-        self.register['created'] = False
-        # No support for multiframe data at the moment
-        self._multiframe_to_singleframe()
+        Unless a full read is requested, only files that are new or 
+        have been modified since the last read are parsed. Changes are 
+        detected from the size and modification time of the files. 
+        This includes files that are not DICOM images, which are 
+        remembered so they are not parsed again until they change. 
+        Files that no longer exist are dropped from the register. The 
+        patient, study and series module attributes of new entities 
+        are read from the header of one of their files and cached.
+
+        Args:
+            workers (int, optional): number of parallel processes 
+                reading the file headers. If this is not provided, 
+                the value set on opening the database is used.
+            full (bool, optional): If True, all files are read again 
+                from scratch. Defaults to False.
+        """
+        if workers is None:
+            workers = self.workers
+        exclude = self._register_files() + [self._cache_folder()]
+        files = filetools.all_files(self.path, exclude=exclude)
+        relpaths = [os.path.relpath(f, self.path) for f in files]
+        size, mtime = filetools.fingerprint(files)
+
+        current = getattr(self, 'register', None)
+        if full or current is None or 'mtime' not in current.columns:
+            self._modules = {level: {} for level, _, _ in MODULES}
+            self._skipped = {}
+            self.register = self._read_files(files, size, mtime, workers)
+        else:
+            # Files that were skipped before and have not changed
+            fps = dict(zip(relpaths, zip(size, mtime)))
+            self._skipped = {
+                f: fp for f, fp in self._skipped.items() if fps.get(f) == fp}
+            # Keep the rows of files that have not changed, including 
+            # the rows of the frames of multi-frame files.
+            fp = pd.DataFrame({'size': size, 'mtime': mtime}, index=relpaths)
+            fp = fp.reindex([register.split_key(k)[0] for k in current.index])
+            unchanged = (
+                (current['size'].values == fp['size'].values) &
+                (current['mtime'].values == fp['mtime'].values))
+            keep = current.index[unchanged]
+            keep_set = set(fp.index[unchanged])
+            new = [i for i, f in enumerate(relpaths) 
+                   if f not in keep_set and f not in self._skipped]
+            if new == []:
+                self.register = current.loc[keep]
+                return self
+            df = self._read_files(
+                [files[i] for i in new], 
+                [size[i] for i in new], 
+                [mtime[i] for i in new], 
+                workers)
+            if df.empty:
+                # None of the new files are images
+                self.register = current.loc[keep]
+                return self
+            # Entities with new or modified files are read again
+            for level, column, _ in MODULES:
+                for uid in df[column].dropna().unique():
+                    self._modules[level].pop(uid, None)
+            for read in self._extra_columns.values():
+                read.difference_update(current.index[~unchanged])
+            self.register = register.concat(current.loc[keep], df)
+        # Multiframe files are listed frame by frame
+        self._index_frames(workers)
         # For now ensure all series have just a single CIOD
         self._split_series()
+        self._scan_modules(workers)
         return self
     
 
@@ -65,6 +441,9 @@ class DataBaseDicom():
         
         This also saves changes in the header file to disk.
         """
+        if self._unloaded is not None:
+            # Nothing has changed since the register was saved
+            return self
 
         created = self.register.created & (self.register.removed==False) 
         removed = self.register.removed
@@ -72,8 +451,7 @@ class DataBaseDicom():
         removed = removed[removed].index
 
         # delete datasets marked for removal
-        for index in removed.tolist():
-            file = os.path.join(self.path, index)
+        for file in self._files(removed):
             if os.path.exists(file): 
                 os.remove(file)
         # and drop then from the register
@@ -82,23 +460,23 @@ class DataBaseDicom():
         # for new or edited data, mark as saved.
         self.register.loc[created, 'created'] = False
 
-        # save register
-        file = self._register_file()
-        self.register.to_pickle(file)
+        self._save_register()
         return self
     
 
     def restore(self): 
         """Restore the DICOM folder to the last saved state.""" 
+        if self._unloaded is not None:
+            return self
 
         created = self.register.created 
         removed = self.register.removed & (self.register.created==False)
         created = created[created].index
         removed = removed[removed].index
+        self._uncache(created.append(removed))
 
         # permanently delete newly created datasets
-        for index in created.tolist():
-            file = os.path.join(self.path, index)
+        for file in self._files(created):
             if os.path.exists(file): 
                 os.remove(file)
 
@@ -107,10 +485,9 @@ class DataBaseDicom():
 
         # Restore those that were marked for removal
         self.register.loc[removed, 'removed'] = False
+        self._hierarchy = None
 
-        # save register
-        file = self._register_file()
-        self.register.to_pickle(file)
+        self._save_register()
         return self    
 
 
@@ -120,15 +497,15 @@ class DataBaseDicom():
         Returns:
             dict: Nested dictionary with summary information on the database.
         """
-        return register.summary(self.register)
+        return register.summary(self._register, self._tree())
     
     def print(self):
         """Print the contents of the DICOM folder
         """
-        register.print_tree(self.register)
+        register.print_tree(self._register, self._tree())
         return self
     
-    def patients(self, name=None, contains=None, isin=None):
+    def patients(self, name=None, contains=None, isin=None, where=None):
         """Return a list of patients in the DICOM folder.
 
         Args:
@@ -139,13 +516,20 @@ class DataBaseDicom():
                 Defaults to None.
             isin (list, optional): List of PatientName values, to search 
                 for patients whose name is in the list. Defaults to None.
+            where (dict, optional): only return patients with files 
+                where the register columns in the keys have one of the 
+                values in the values. Values can be single values or 
+                lists. Columns that are not in the register by default 
+                can be added with add_columns(). Defaults to None.
 
         Returns:
             list: list of patients fulfilling the criteria.
         """
-        return register.patients(self.register, self.path, name, contains, isin)
+        return register.patients(
+            self._register, self.path, name, contains, isin, self._tree(), 
+            self._select(where))
     
-    def studies(self, entity=None, name=None, contains=None, isin=None):
+    def studies(self, entity=None, name=None, contains=None, isin=None, where=None):
         """Return a list of studies in the DICOM folder.
 
         Args:
@@ -159,6 +543,9 @@ class DataBaseDicom():
                 Defaults to None.
             isin (list, optional): List of StudyDescription values, to search 
                 for studies whose description is in a list. Defaults to None.
+            where (dict, optional): only return studies with files 
+                where the register columns in the keys have one of the 
+                values in the values. See patients(). Defaults to None.
 
         Returns:
             list: list of studies fulfilling the criteria.
@@ -166,14 +553,19 @@ class DataBaseDicom():
         if entity == None:
             entity = self.path
         if isinstance(entity, str):
-            studies = []
-            for patient in self.patients():
-                studies += self.studies(patient, name, contains, isin)
-            return studies
+            patients = self.patients()
         else:
-            return register.studies(self.register, entity, name, contains, isin)
+            patients = [entity]
+        # The files are selected once for all patients
+        selected = self._select(where)
+        studies = []
+        for patient in patients:
+            studies += register.studies(
+                self._register, patient, name, contains, isin, 
+                self._tree(), selected)
+        return studies
     
-    def series(self, entity=None, name=None, contains=None, isin=None):
+    def series(self, entity=None, name=None, contains=None, isin=None, where=None):
         """Return a list of series in the DICOM folder.
 
         Args:
@@ -188,27 +580,61 @@ class DataBaseDicom():
                 Defaults to None.
             isin (list, optional): List of SeriesDescription values, to search 
                 for series whose description is in a list. Defaults to None.
+            where (dict, optional): only return series with files 
+                where the register columns in the keys have one of the 
+                values in the values. See patients(). Defaults to None.
 
         Returns:
             list: list of series fulfilling the criteria.
         """
         if entity == None:
             entity = self.path
-        if isinstance(entity, str):
-            series = []
-            for study in self.studies(entity):
-                series += self.series(study, name, contains, isin)
-            return series
-        elif len(entity)==2:
-            series = []
-            for study in self.studies(entity):
-                series += self.series(study, name, contains, isin)
-            return series
-        else: # path = None (all series) or path = patient (all series in patient)
-            return register.series(self.register, entity, name, contains, isin)
-
-
-    def volume(self, series:list, dims:list=None, multislice=False) -> vreg.Volume3D:
+        if isinstance(entity, str) or len(entity)==2:
+            studies = self.studies(entity)
+        else:
+            studies = [entity]
+        # The files are selected once for all studies
+        selected = self._select(where)
+        series = []
+        for study in studies:
+            series += register.series(
+                self._register, study, name, contains, isin, 
+                self._tree(), selected)
+        return series
+
+
+    def add_columns(self, attributes:list, workers:int=None):
+        """Add DICOM attributes to the register as columns.
+
+        The attributes are read once from the headers of all files. 
+        They are then saved with the register and kept up to date 
+        when files are added, so that they can be used in queries 
+        such as series(where={'EchoTime': 2.3}) without reading any 
+        files. Indexes are created for them in an SQLite register.
+
+        Args:
+            attributes (list): DICOM keywords of the attributes.
+            workers (int, optional): number of parallel processes 
+                reading the file headers. If this is not provided, 
+                the value set on opening the database is used.
+        """
+        if np.isscalar(attributes):
+            attributes = [attributes]
+        for a in attributes:
+            if not isinstance(a, str):
+                raise ValueError(
+                    f"Cannot add {a} to the register. Columns need to be "
+                    "identified by a DICOM keyword.")
+        self._read_columns(attributes, self.register.index, workers)
+        for a in attributes:
+            if a in self._extra_columns:
+                del self._extra_columns[a]
+                self.register[a] = self.register[a].infer_objects()
+        return self
+
+
+    def volume(self, series:list, dims:list=None, multislice=False, 
+               workers:int=None) -> vreg.Volume3D:
         """Read a vreg.Volume3D from a DICOM series
 
         Args:
@@ -217,57 +643,45 @@ class DataBaseDicom():
             multislice (bool, optional): Whether the data are to be read 
                 as multislice or not. In multislice data the voxel size 
                 is taken from the slice gap rather thsan the slice thickness. Defaults to False.
+            workers (int, optional): number of threads decoding the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
 
         Returns:
             vreg.Volume3D: vole read from the series.
         """
 
-        if dims is None:
-            dims = []
-        elif isinstance(dims, str):
-            dims = [dims]
-        else:
-            dims = list(dims)
-        dims = ['SliceLocation'] + dims
-
-        files = register.files(self.register, series)
-        
-        # Read dicom files
-        values = []
-        volumes = []
-        for f in tqdm(files, desc='Reading volume..'):
-            ds = dbdataset.read_dataset(f)  
-            values.append(dbdataset.get_values(ds, dims))
-            volumes.append(dbdataset.volume(ds, multislice))
-
-        # Format as mesh
-        coords = np.stack(values, axis=-1)
-        coords, inds = dbdicom.utils.arrays.meshvals(coords)
-        vols = np.array(volumes)
-        vols = vols[inds].reshape(coords.shape[1:])
-
-        # Check that all slices have the same coordinates
-        c0 = coords[1:,0,...]
-        for k in range(coords.shape[1]-1):
-            if not np.array_equal(coords[1:,k+1,...], c0):
-                raise ValueError(
-                    "Cannot build a single volume. Not all slices "
-                    "have the same coordinates. \nIf you set " 
-                    "firstslice=True, the coordinates of the lowest "
-                    "slice will be assigned to the whole volume."     
-                )
-
-        # Join 2D volumes into 3D volumes
-        vol = vreg.join(vols)
-        if vol.ndim > 3:
-            vol.set_coords(c0)
-            vol.set_dims(dims[1:])
-        return vol
+        dims = _volume_dims(dims)
+
+        if self.disk_cache is not None:
+            group, key = self._disk_cache_key(series, 'volume', dims, multislice)
+            entry = self.disk_cache.get(group, key)
+            if entry is not None:
+                values, other = entry
+                if values.ndim == 3:
+                    return vreg.volume(values, other['affine'])
+                return vreg.volume(values, other['affine'], 
+                                   list(other['coords']), dims[1:])
+
+        files = register.files(self._register, series, self._tree())
+        if workers is None:
+            workers = self.workers
+        tags = dbdataset.compile_tags(dims)
+        values, affines, data = _read_slices(
+            files, tags, multislice, workers, 'Reading volume..', 
+            self.cache, self.path)
+        inds, affine, c0 = _volume_geometry(values, affines)
+        values = _to_mesh(data, inds, inds.shape)
+        if self.disk_cache is not None:
+            self.disk_cache.put(group, key, values, affine=affine, coords=c0)
+        if values.ndim == 3:
+            return vreg.volume(values, affine)
+        return vreg.volume(values, affine, list(c0), dims[1:])
 
     
     def write_volume(
             self, vol:vreg.Volume3D, series:list, 
-            ref:list=None, multislice=False,
+            ref:list=None, multislice=False, workers:int=None,
         ):
         """Write a vreg.Volume3D to a DICOM series
 
@@ -278,43 +692,32 @@ class DataBaseDicom():
             multislice (bool, optional): Whether the data are to be read 
                 as multislice or not. In multislice data the voxel size 
                 is taken from the slice gap rather thsan the slice thickness. Defaults to False.
+            workers (int, optional): number of threads writing the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
         """
-        if ref is None:
-            ds = dbdataset.new_dataset('MRImage')
-        else:
-            if ref[0] == series[0]:
-                ref_mgr = self
-            else:
-                ref_mgr = DataBaseDicom(ref[0])
-            files = register.files(ref_mgr.register, ref)
-            ds = dbdataset.read_dataset(files[0]) 
-
-        # Get the attributes of the destination series
-        attr = self._attributes(series)
-        n = self._max_instance_number(attr['SeriesInstanceUID'])
-
-        new_instances = {}
-        if vol.ndim==3:
-            slices = vol.split()
-            for i, sl in tqdm(enumerate(slices), desc='Writing volume..'):
-                dbdataset.set_volume(ds, sl, multislice)
-                self._write_dataset(ds, attr, n + 1 + i, new_instances)
-        else:
-            i=0
-            vols = vol.separate().reshape(-1)
-            for vt in tqdm(vols, desc='Writing volume..'):
-                for sl in vt.split():
-                    dbdataset.set_volume(ds, sl, multislice)
-                    dbdataset.set_value(ds, sl.dims, sl.coords[:,...])
-                    self._write_dataset(ds, attr, n + 1 + i, new_instances)
-                    i+=1
-            return self
-        self._update_register(new_instances)
+        # Slices are ordered by the non-spatial indices, and by slice 
+        # within each of those.
+        values = vol.values
+        nz, shape = values.shape[2], values.shape[3:]
+        images = (
+            (i, values[(slice(None), slice(None), i % nz) + np.unravel_index(i // nz, shape)]) 
+            for i in range(nz * int(np.prod(shape, dtype=int))))
+        self._write_images(images, values.shape, vol.affine, vol.dims, vol.coords, 
+                           series, ref, multislice, workers)
+        return self
 
 
-    def to_nifti(self, series:list, file:str, dims=None, multislice=False):
+    def to_nifti(self, series:list, file:str, dims=None, multislice=False, 
+                 workers:int=None):
         """Save a DICOM series in nifti format.
 
+        The volume is not built in memory. Its header is computed from 
+        the headers of the files, and the pixel data are then decoded 
+        and written slice by slice, so only a few slices are in memory 
+        at any time. Files ending in .nii.gz are compressed in a 
+        background thread.
+
         Args:
             series (list): DICOM series to read
             file (str): file path of the nifti file.
@@ -323,14 +726,46 @@ class DataBaseDicom():
             multislice (bool, optional): Whether the data are to be read 
                 as multislice or not. In multislice data the voxel size 
                 is taken from the slice gap rather thaan the slice thickness. Defaults to False.
+            workers (int, optional): number of threads decoding the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
         """
-        vol = self.volume(series, dims, multislice)
-        vreg.write_nifti(vol, file)
+        dims = _volume_dims(dims)
+        if workers is None:
+            workers = self.workers
+
+        if self.disk_cache is not None:
+            group, key = self._disk_cache_key(series, 'volume', dims, multislice)
+            entry = self.disk_cache.get(group, key)
+            if entry is not None:
+                # Slices of the memory-mapped volume, in the order of 
+                # the nifti file
+                values, other = entry
+                slices = (values[(slice(None), slice(None)) + k[::-1]] 
+                          for k in np.ndindex(values.shape[2:][::-1]))
+                nifti.write(file, values.shape, other['affine'], slices)
+                return self
+
+        files = register.files(self._register, series, self._tree())
+        tags = dbdataset.compile_tags(dims)
+        values, affines, size = _read_geometry(
+            files, tags, multislice, workers, 'Reading headers..')
+        inds, affine, _ = _volume_geometry(values, affines)
+        # The slice dimension changes fastest in the file
+        files = [files[i] for i in inds.flatten(order='F')]
+        nifti.write(file, size + inds.shape, affine, 
+                    _stream_slices(files, workers, self.cache, self.path))
         return self
 
-    def from_nifti(self, file:str, series:list, ref:list=None, multislice=False):
+    def from_nifti(self, file:str, series:list, ref:list=None, multislice=False, 
+                   dims:list=None, coords:list=None, workers:int=None):
         """Create a DICOM series from a nifti file.
 
+        The image is not loaded in memory. Slices are read one at a 
+        time, memory-mapped from .nii files or decompressed as a 
+        stream from .nii.gz files, and written to DICOM while the next 
+        slices are read.
+
         Args:
             file (str): file path of the nifti file.
             series (list): DICOM series to create
@@ -338,12 +773,41 @@ class DataBaseDicom():
             multislice (bool, optional): Whether the data are to be written
                 as multislice or not. In multislice data the voxel size 
                 is written in the slice gap rather thaan the slice thickness. Defaults to False.
+            dims (list, optional): DICOM keywords of the non-spatial 
+                dimensions, for files with more than 3 dimensions. 
+                Defaults to None.
+            coords (list, optional): coordinates of the non-spatial 
+                dimensions, as in vreg.read_nifti(). Defaults to None 
+                (index arrays).
+            workers (int, optional): number of threads writing the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
         """
-        vol = vreg.read_nifti(file)
-        self.write_volume(vol, series, ref, multislice)
+        shape, affine = nifti.read_header(file)
+        nz, extra = shape[2], shape[3:]
+        if extra != () and dims is None:
+            raise ValueError(
+                f"Cannot write {file} to DICOM. It has {len(shape)} "
+                "dimensions, so dims needs to provide DICOM keywords "
+                "for the non-spatial dimensions.")
+        if extra != () and coords is None:
+            coords = np.meshgrid(*[np.arange(n) for n in extra], indexing='ij')
+
+        def images():
+            # The file holds the slices with the first index changing 
+            # fastest, while they are numbered with the last index 
+            # changing fastest.
+            for j, image in enumerate(nifti.read_slices(file)):
+                t, k = divmod(j, nz)
+                t = np.unravel_index(t, extra, order='F')
+                yield int(np.ravel_multi_index(t, extra)) * nz + k, image
+
+        self._write_images(images(), shape, affine, dims, coords, 
+                           series, ref, multislice, workers)
         return self
     
-    def pixel_data(self, series:list, dims:list=None, include=None) -> np.ndarray:
+    def pixel_data(self, series:list, dims:list=None, include=None, 
+                   workers:int=None) -> np.ndarray:
         """Read the pixel data from a DICOM series
 
         Args:
@@ -351,6 +815,9 @@ class DataBaseDicom():
             dims (list, optional): Dimensions of the array.
             include (list, optional): list of DICOM attributes that are 
                 read on the fly to avoid reading the data twice.
+            workers (int, optional): number of threads decoding the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
 
         Returns:
             tuple: numpy array with pixel values and an array with 
@@ -372,35 +839,34 @@ class DataBaseDicom():
         else:
             params = list(include)
 
-        files = register.files(self.register, series)
-        
-        # Read dicom files
-        coords = []
-        arrays = np.empty(len(files), dtype=dict)
-        if include is not None:
-            values = np.empty(len(files), dtype=dict)
-        for i, f in tqdm(enumerate(files), desc='Reading pixel data..'):
-            ds = dbdataset.read_dataset(f)  
-            coords.append(dbdataset.get_values(ds, dims))
-            # save as dict so numpy does not stack as arrays
-            arrays[i] = {'pixel_data': dbdataset.pixel_data(ds)}
-            if include is not None:
-                values[i] = {'values': dbdataset.get_values(ds, params)}
+        if self.disk_cache is not None:
+            group, key = self._disk_cache_key(series, 'pixel_data', dims, params)
+            entry = self.disk_cache.get(group, key)
+            if entry is not None:
+                arrays, other = entry
+                if include is None:
+                    return arrays, other['coords']
+                return arrays, other['coords'], other['values']
+
+        files = register.files(self._register, series, self._tree())
+        if workers is None:
+            workers = self.workers
+        tags = dbdataset.compile_tags(dims + params)
+        values, _, arrays = _read_slices(
+            files, tags, workers=workers, desc='Reading pixel data..', 
+            cache=self.cache, path=self.path)
 
         # Format as mesh
-        coords = np.stack([v for v in coords], axis=-1)
+        coords = np.stack([v[:len(dims)] for v in values], axis=-1)
         coords, inds = dbdicom.utils.arrays.meshvals(coords)
-
-        arrays = arrays[inds].reshape(coords.shape[1:])
-        arrays = np.stack([a['pixel_data'] for a in arrays.reshape(-1)], axis=-1)
-        arrays = arrays.reshape(arrays.shape[:2] + coords.shape[1:])
+        arrays = _to_mesh(arrays, inds, coords.shape[1:])
+        values = np.stack([values[i][len(dims):] for i in inds], axis=-1)
+        values = values.reshape((len(params), ) + coords.shape[1:])
+        if self.disk_cache is not None:
+            self.disk_cache.put(group, key, arrays, coords=coords, values=values)
 
         if include is None:
             return arrays, coords
-        
-        values = values[inds].reshape(coords.shape[1:])
-        values = np.stack([a['values'] for a in values.reshape(-1)], axis=-1)
-        values = values.reshape((len(params), ) + coords.shape[1:])
 
         return arrays, coords, values
     
@@ -416,34 +882,22 @@ class DataBaseDicom():
             dict: dictionary with unique values for each attribute.
         """
         v = self._values(pars, entity)
-
-        # Return a list with unique values for each attribute
-        values = []
-        for a in range(v.shape[1]):
-            va = v[:,a]
-            # Remove None values
-            va = va[[x is not None for x in va]]
-            va = list(va)
-            # Get unique values and sort
-            va = [x for i, x in enumerate(va) if i==va.index(x)]
-            if len(va) == 0:
-                va = None
-            elif len(va) == 1:
-                va = va[0]
-            else:
-                try: 
-                    va.sort()
-                except:
-                    pass
-            values.append(va)
+        values = [_unique(v[:,a]) for a in range(v.shape[1])]
         return {p: values[i] for i, p in enumerate(pars)} 
     
-    def copy(self, from_entity, to_entity):
+    def copy(self, from_entity, to_entity, workers:int=None, cancel=None):
         """Copy a DICOM  entity (patient, study or series)
 
         Args:
             from_entity (list): entity to copy
             to_entity (list): entity after copying.
+            workers (int, optional): number of threads copying the 
+                files. If this is not provided, the value set on 
+                opening the database is used.
+            cancel (threading.Event, optional): Event that can be set 
+                from another thread to cancel the copy. Files that 
+                were already copied are then removed again, and the 
+                destination is left unchanged. Defaults to None.
         """
         if len(from_entity) == 4:
             if len(to_entity) != 4:
@@ -451,24 +905,35 @@ class DataBaseDicom():
                     f"Cannot copy series {from_entity} to series {to_entity}. "
                     f"{to_entity} is not a series (needs 4 elements)."
                 )
-            return self._copy_series(from_entity, to_entity)
-        if len(from_entity) == 3:
+            plan = self._plan_series_copy
+        elif len(from_entity) == 3:
             if len(to_entity) != 3:
                 raise ValueError(
                     f"Cannot copy study {from_entity} to study {to_entity}. "
                     f"{to_entity} is not a study (needs 3 elements)."
                 )
-            return self._copy_study(from_entity, to_entity)
-        if len(from_entity) == 2:
+            plan = self._plan_study_copy
+        elif len(from_entity) == 2:
             if len(to_entity) != 2:
                 raise ValueError(
                     f"Cannot copy patient {from_entity} to patient {to_entity}. "
                     f"{to_entity} is not a patient (needs 2 elements)."
                 )                
-            return self._copy_patient(from_entity, to_entity)
-        raise ValueError(
-            f"Cannot copy {from_entity} to {to_entity}. "
-        )
+            plan = self._plan_patient_copy
+        else:
+            raise ValueError(
+                f"Cannot copy {from_entity} to {to_entity}. "
+            )
+        # The destination database is opened once for all series
+        if to_entity[0] == from_entity[0]:
+            mgr = self
+        else:
+            mgr = DataBaseDicom(to_entity[0])
+        copies = plan(from_entity, to_entity, mgr)
+        mgr._copy_files(copies, workers, cancel, f'Copying {from_entity[1:]}')
+        if mgr is not self:
+            mgr.close()
+        return self
     
     def delete(self, entity):
         """Delete a DICOM entity from the database
@@ -476,97 +941,198 @@ class DataBaseDicom():
         Args:
             entity (list): entity to delete
         """
-        index = register.index(self.register, entity)
+        index = register.index(self.register, entity, self._tree())
         self.register.loc[index,'removed'] = True
+        register.remove_from_tree(self._tree(), entity)
+        self._uncache(index)
         return self
 
-    def move(self, from_entity, to_entity):
+    def move(self, from_entity, to_entity, workers:int=None, cancel=None):
         """Move a DICOM entity
 
         Args:
             entity (list): entity to move
+            workers (int, optional): see copy().
+            cancel (threading.Event, optional): see copy(). If the 
+                move is cancelled the entity is not deleted.
         """
-        self.copy(from_entity, to_entity)
-        self.delete(from_entity)
+        self.copy(from_entity, to_entity, workers, cancel)
+        if cancel is None or not cancel.is_set():
+            self.delete(from_entity)
         return self
 
     def _values(self, attributes:list, entity:list):
         # Create a np array v with values for each instance and attribute
-        if set(attributes) <= set(self.register.columns):
-            index = register.index(self.register, entity)
-            v = self.register.loc[index, attributes].values
-        else:
-            files = register.files(self.register, entity)
-            v = np.empty((len(files), len(attributes)), dtype=object)
-            for i, f in enumerate(files):
-                ds = dbdataset.read_dataset(f)
-                v[i,:] = dbdataset.get_values(ds, attributes)
-        return v
-
-    def _copy_patient(self, from_patient, to_patient):
-        from_patient_studies = register.studies(self.register, from_patient)
-        for from_study in tqdm(from_patient_studies, desc=f'Copying patient {from_patient[1:]}'):
-            if to_patient[0]==from_patient[0]:
-                to_study = register.append(self.register, to_patient, from_study[-1])
-            else:
-                mgr = DataBaseDicom(to_study[0])
-                to_study = register.append(mgr.register, to_patient, from_study[-1])                
-            self._copy_study(from_study, to_study)
-
-    def _copy_study(self, from_study, to_study):
-        from_study_series = register.series(self.register, from_study)
-        for from_series in tqdm(from_study_series, desc=f'Copying study {from_study[1:]}'):
-            if to_study[0]==from_study[0]:
-                to_series = register.append(self.register, to_study, from_series[-1])
-            else:
-                mgr = DataBaseDicom(to_study[0])
-                to_series = register.append(mgr.register, to_study, from_series[-1])
-            self._copy_series(from_series, to_series)
-
-    def _copy_series(self, from_series, to_series):
-        # Get the files to be exported
-        from_series_files = register.files(self.register, from_series)
-
-        if to_series[0] == from_series[0]:
-            # Copy in the same database
-            self._files_to_series(from_series_files, to_series)
-        else:
-            # Copy to another database
-            mgr = DataBaseDicom(to_series[0])
-            mgr._files_to_series(from_series_files, to_series)
-            mgr.close()
-
+        if self._unloaded is not None:
+            v = self._saved_values(attributes, entity)
+            if v is not None:
+                return v
+        index = register.index(self.register, entity, self._tree())
+        if set(attributes) <= set(self.register.columns) - set(self._extra_columns):
+            return self.register.loc[index, attributes].values
+        if not all(isinstance(a, str) for a in attributes):
+            # Tags that cannot be register columns are read every time
+            rows = self._header_values(index, attributes)
+            v = np.empty((len(rows), len(attributes)), dtype=object)
+            for i, row in enumerate(rows):
+                v[i,:] = row
+            return v
+        self._read_columns(attributes, index)
+        return self.register.loc[index, attributes].values
+
+    def _saved_values(self, attributes:list, entity:list):
+        # Values of attributes in the files of an entity, read from the 
+        # rows of the entity in the SQLite register. Returns None if 
+        # the attributes are not all saved in the register.
+        tree = self._tree()
+        index = register.index(None, entity, tree)
+        where = None
+        if not isinstance(entity, str):
+            column = register.UIDS[len(entity) - 2]
+            where = {column: register.uid(None, entity, tree)}
+        try:
+            df = store.read(self._unloaded, list(attributes), where)
+        except ValueError:
+            return None
+        return df.loc[index, attributes].values
+
+    def _read_columns(self, attributes:list, index, workers=None):
+        # Read attributes that are not in the register from the file 
+        # headers and keep them as extra register columns, so they are 
+        # only read once for each file.
+        read = []
+        for a in attributes:
+            if a not in self.register.columns:
+                self.register[a] = pd.Series(None, index=self.register.index, dtype=object)
+                self._extra_columns[a] = set()
+            if a in self._extra_columns:
+                read.append(a)
+        if read == []:
+            return
+        index = [i for i in index 
+                 if any(i not in self._extra_columns[a] for a in read)]
+        if index == []:
+            return
+        if workers is None:
+            workers = self.workers
+        files = [os.path.join(self.path, f) for f in index 
+                 if register.split_key(f)[1] is None]
+        # The headers are small, so threads are faster than processes
+        df = dbdataset.read_dataframe(files, read, path=self.path, 
+                                      workers=workers, processes=False)
+        frames = [f for f in index if register.split_key(f)[1] is not None]
+        if frames != []:
+            rows = self._header_values(frames, read, workers)
+            df = pd.concat([df, pd.DataFrame(rows, columns=read, index=frames)])
+        df = df.reindex(index)
+        for a in read:
+            values = df[a].astype(object).where(df[a].notna(), None)
+            self.register.loc[index, a] = values.values
+            self._extra_columns[a].update(index)
+
+    def _header_values(self, index, tags, workers=None):
+        # Values of tags in the headers of the files or frames with 
+        # given register indices, as a list of rows. The header of a 
+        # multi-frame file is read once for all its frames.
+        if workers is None:
+            workers = self.workers
+        keys = [register.split_key(i) for i in index]
+        multiframe = {f for f, frame in keys if frame is not None}
+
+        def read(file):
+            path = os.path.join(self.path, file)
+            if file in multiframe:
+                return _frame_values(path, tags)
+            return [dbdataset.get_values(dbdataset.read_header(path), tags)]
+
+        files = list(dict.fromkeys(f for f, _ in keys))
+        values = dict(zip(files, parallel.map_items(read, files, workers)))
+        return [values[f][frame or 0] for f, frame in keys]
+
+    def _plan_patient_copy(self, from_patient, to_patient, mgr):
+        # Each study of the patient is copied to a new study in the 
+        # destination patient.
+        patient_attr = mgr._patient_attributes(to_patient)
+        copies = []
+        for from_study in register.studies(self.register, from_patient, tree=self._tree()):
+            study_attr = patient_attr | mgr._new_study_attributes(from_study[-1])
+            copies += self._plan_series_copies(from_study, study_attr, mgr)
+        return copies
+
+    def _plan_study_copy(self, from_study, to_study, mgr):
+        # Each series of the study is copied to a new series in the 
+        # destination study.
+        return self._plan_series_copies(from_study, mgr._study_attributes(to_study), mgr)
+
+    def _plan_series_copies(self, from_study, study_attr, mgr):
+        n = mgr._max_series_number(study_attr['StudyInstanceUID'])
+        copies = []
+        for i, from_series in enumerate(register.series(self.register, from_study, tree=self._tree())):
+            files = register.files(self.register, from_series, self._tree())
+            attr = study_attr | mgr._new_series_attributes(from_series[-1], n + 1 + i)
+            copies.append((files, attr))
+        return copies
+
+    def _plan_series_copy(self, from_series, to_series, mgr):
+        files = register.files(self.register, from_series, self._tree())
+        return [(files, mgr._attributes(to_series))]
 
     def _files_to_series(self, files, to_series):
-
-        # Get the attributes of the destination series
-        attr = self._attributes(to_series)
-        n = self._max_instance_number(attr['SeriesInstanceUID'])
-        
-        # Copy the files to the new series 
-        new_instances = {}
-        for i, f in tqdm(enumerate(files), total=len(files), desc=f'Copying series {to_series[1:]}'):
-            # Read dataset and assign new properties
-            ds = dbdataset.read_dataset(f)
-            self._write_dataset(ds, attr, n + 1 + i, new_instances)
-        self._update_register(new_instances)
+        self._copy_files([(files, self._attributes(to_series))], 
+                         desc=f'Copying series {to_series[1:]}')
+
+    def _copy_files(self, copies, workers=None, cancel=None, desc=None):
+        # Copy files to series in this database. copies is a list with 
+        # the files to copy to each series and the attributes of the 
+        # series. All files are copied in one thread pool and the new 
+        # rows are added to the register in one step at the end.
+        if workers is None:
+            workers = self.workers
+        tasks = []
+        for files, attr in copies:
+            n = self._max_instance_number(attr['SeriesInstanceUID'])
+            for i, f in enumerate(files):
+                tasks.append((f, attr | {
+                    'SOPInstanceUID': dbdataset.new_uid(), 
+                    'InstanceNumber': n + 1 + i,
+                }))
+        columns = self._file_columns()
+
+        # Frames of multi-frame files are copied to single-frame files
+        keys = {f: register.split_key(f) for f, _ in tasks}
+        frames = _split_frames(keys.values(), workers)
+
+        def copy(task):
+            # Only the headers are parsed and the new attributes 
+            # spliced into the copies.
+            f, attr = task
+            rel_path = os.path.join('dbdicom', dbdataset.new_uid() + '.dcm') 
+            file, frame = keys[f]
+            if frame is None:
+                ds = dbdataset.copy_file(f, os.path.join(self.path, rel_path), 
+                                         list(attr.keys()), list(attr.values()))
+            else:
+                ds = dbdataset.copy_frame(frames[file][frame], os.path.join(self.path, rel_path), 
+                                          list(attr.keys()), list(attr.values()))
+            self._cache_modules(ds)
+            return rel_path, dbdataset.get_values(ds, columns)
+
+        rows = parallel.map_items(copy, tasks, workers, desc, cancel)
+        if None in rows:
+            # Cancelled - remove the copies that were made
+            for row in rows:
+                if row is not None:
+                    os.remove(os.path.join(self.path, row[0]))
+            return
+        if rows != []:
+            self._update_register(dict(rows))
 
 
     def _max_series_number(self, study_uid):
-        df = self.register
-        df = df[(df.StudyInstanceUID==study_uid) & (df.removed==False)]
-        n = df['SeriesNumber'].values
-        n = n[n != -1]
-        max_number=0 if n.size==0 else np.amax(n)  
-        return max_number 
+        return register.max_series_number(self._tree(), study_uid)
 
     def _max_instance_number(self, series_uid):
-        df = self.register
-        df = df[(df.SeriesInstanceUID==series_uid) & (df.removed==False)]
-        n = df['InstanceNumber'].values
-        n = n[n != -1]
-        max_number=0 if n.size==0 else np.amax(n)  
-        return max_number 
+        return register.max_instance_number(self._tree(), series_uid)
 
 
     def _attributes(self, entity):
@@ -580,109 +1146,402 @@ class DataBaseDicom():
 
     def _patient_attributes(self, patient):
         try:
-            # If the patient exists and has files, read from file
-            files = register.files(self.register, patient)
-            attr = const.PATIENT_MODULE
-            ds = dbdataset.read_dataset(files[0])
-            vals = dbdataset.get_values(ds, attr)
+            # If the patient exists and has files, use its attributes
+            return self._module_attributes(patient, 'patient')
         except:
             # If the patient does not exist, generate values
-            attr = ['PatientID', 'PatientName']
-            patient_id = dbdataset.new_uid()
             patient_name = patient[-1] if isinstance(patient[-1], str) else patient[-1][0]
-            vals = [patient_id, patient_name]
-        return {attr[i]:vals[i] for i in range(len(attr)) if vals[i] is not None}
+            return {'PatientID': dbdataset.new_uid(), 'PatientName': patient_name}
 
 
     def _study_attributes(self, study):
         patient_attr = self._patient_attributes(study[:2])
         try:
-            # If the study exists and has files, read from file
-            files = register.files(self.register, study)
-            attr = const.STUDY_MODULE
-            ds = dbdataset.read_dataset(files[0])
-            vals = dbdataset.get_values(ds, attr)
+            # If the study exists and has files, use its attributes
+            study_attr = self._module_attributes(study, 'study')
         except:
             # If the study does not exist, generate values
-            attr = ['StudyInstanceUID', 'StudyDescription', 'StudyDate']
-            study_id = dbdataset.new_uid()
-            study_desc = study[-1] if isinstance(study[-1], str) else study[-1][0]
-            study_date = datetime.today().strftime('%Y%m%d')
-            vals = [study_id, study_desc, study_date]
-        return patient_attr | {attr[i]:vals[i] for i in range(len(attr)) if vals[i] is not None}
+            return patient_attr | self._new_study_attributes(study[-1])
+        return patient_attr | study_attr
+
+
+    def _new_study_attributes(self, name):
+        return {
+            'StudyInstanceUID': dbdataset.new_uid(),
+            'StudyDescription': name if isinstance(name, str) else name[0],
+            'StudyDate': datetime.today().strftime('%Y%m%d'),
+        }
 
 
     def _series_attributes(self, series):
         study_attr = self._study_attributes(series[:3])
         try:
-            # If the series exists and has files, read from file
-            files = register.files(self.register, series)
-            attr = const.SERIES_MODULE
-            ds = dbdataset.read_dataset(files[0])
-            vals = dbdataset.get_values(ds, attr)
+            # If the series exists and has files, use its attributes
+            series_attr = self._module_attributes(series, 'series')
         except:
             # If the series does not exist or is empty, generate values
             try:
-                study_uid = register.uid(self.register, series[:-1])
+                study_uid = register.uid(self.register, series[:-1], self._tree())
             except:
                 series_number = 1
             else:
                 series_number = 1 + self._max_series_number(study_uid)
-            attr = ['SeriesInstanceUID', 'SeriesDescription', 'SeriesNumber']
-            series_id = dbdataset.new_uid()
-            series_desc = series[-1] if isinstance(series[-1], str) else series[-1][0]
-            vals = [series_id, series_desc, series_number]
-        return study_attr | {attr[i]:vals[i] for i in range(len(attr)) if vals[i] is not None}
+            return study_attr | self._new_series_attributes(series[-1], series_number)
+        return study_attr | series_attr
+
+
+    def _new_series_attributes(self, name, number):
+        return {
+            'SeriesInstanceUID': dbdataset.new_uid(),
+            'SeriesDescription': name if isinstance(name, str) else name[0],
+            'SeriesNumber': number,
+        }
+
+
+    def _module_attributes(self, entity, level):
+        # Module attributes of an existing entity. These are cached, 
+        # and only read from the header of the first file if they are 
+        # not. Raises an error if the entity has no files.
+        tree = self._tree()
+        uid = register.uid(self.register, entity, tree)
+        cache = self._modules[level]
+        if uid not in cache:
+            file, _ = register.split_key(register.files(self.register, entity, tree)[0])
+            self._cache_modules(dbdataset.read_header(file, _module_tags()))
+        return copy.deepcopy(cache[uid])
+
+
+    def _cache_modules(self, ds):
+        # Cache the module attributes of the entities of a dataset, 
+        # unless they are already cached.
+        for level, column, attr in MODULES:
+            uid = dbdataset.get_values(ds, column)
+            if uid is not None and uid not in self._modules[level]:
+                vals = dbdataset.get_values(ds, attr)
+                self._modules[level][uid] = {
+                    a: v for a, v in zip(attr, vals) if v is not None}
+
+
+    def _scan_modules(self, workers=1):
+        # Read the module attributes of entities that are not cached 
+        # from the header of one file in each series.
+        df = self.register[self.register['removed'] == False]
+        missing = np.zeros(len(df), dtype=bool)
+        for level, column, _ in MODULES:
+            missing |= ~df[column].isin(list(self._modules[level])).values
+        df = df[missing].dropna(subset=['SeriesInstanceUID'])
+        files = self._files(df.index[~df.SeriesInstanceUID.duplicated().values])
+        if files == []:
+            return
+        tags = _module_tags()
+        headers = parallel.map_items(
+            lambda f: dbdataset.read_header(f, tags), files, workers, 
+            'Reading module attributes')
+        for ds in headers:
+            self._cache_modules(ds)
+
+
+    def _saved_modules(self):
+        # Module attributes of the entities in the register, as DICOM 
+        # JSON so they can be saved with the register
+        modules = {}
+        for level, column, _ in MODULES:
+            uids = set(self.register[column].dropna().unique())
+            modules[level] = {
+                uid: _to_json(a) for uid, a in self._modules[level].items() 
+                if uid in uids}
+        return modules
 
         
-    def _write_dataset(self, ds:Dataset, attr:dict, instance_nr:int, register:dict):
-        # Set new attributes 
-        attr['SOPInstanceUID'] = dbdataset.new_uid()
-        attr['InstanceNumber'] = instance_nr
+    def _write_images(self, images, shape, affine, dims, coords, series, 
+                      ref=None, multislice=False, workers=None):
+        # Write the 2D images of a volume with a given shape, affine 
+        # and non-spatial dimensions to a series. images yields pairs 
+        # (i, image) in any order, where i is the index of the image 
+        # when they are ordered by the non-spatial indices, and by 
+        # slice within each of those.
+        if ref is None:
+            ds = dbdataset.new_dataset('MRImage')
+        else:
+            if ref[0] == series[0]:
+                ref_mgr = self
+            else:
+                ref_mgr = DataBaseDicom(ref[0])
+            files = register.files(ref_mgr.register, ref, ref_mgr._tree())
+            ds = _read_dataset(files[0])
+
+        # Get the attributes of the destination series
+        attr = self._attributes(series)
+
+        nz, shape = shape[2], tuple(shape[3:])
+        if shape != ():
+            dbdataset.check_dims(dims)
+            coords = [np.asarray(c).astype(object) for c in coords]
+
+        def slices():
+            # Slice k is translated by k times the slice vector.
+            for i, image in images:
+                t, k = divmod(i, nz)
+                t = np.unravel_index(t, shape)
+                sl_affine = affine.copy()
+                sl_affine[:3, 3] += k * affine[:3, 2]
+                sl_values = {} if shape == () else {
+                    d: c[t] for d, c in zip(dims, coords)}
+                yield i, image, sl_affine, sl_values
+
+        nslices = nz * int(np.prod(shape, dtype=int))
+        self._write_slices(ds, attr, nslices, slices(), multislice, workers)
+
+
+    def _write_slices(self, ds:Dataset, attr:dict, nslices:int, slices, 
+                      multislice=False, workers=None):
+        # Write slices with a shared header to a series. The header is
+        # set up once and each slice only sets its own data elements,
+        # so the files can be written in a thread pool. slices yields 
+        # the index, image and affine of each slice, and a dictionary 
+        # with the values of any other data elements of the slice. 
+        # They are taken from slices only as the threads need them.
+        if workers is None:
+            workers = self.workers
+        n = self._max_instance_number(attr['SeriesInstanceUID'])
         dbdataset.set_values(ds, list(attr.keys()), list(attr.values()))
-        # Save results in a new file
-        rel_path = os.path.join('dbdicom', dbdataset.new_uid() + '.dcm') 
-        dbdataset.write(ds, os.path.join(self.path, rel_path))
-        # Add a row to the register
-        register[rel_path] = dbdataset.get_values(ds, self.register.columns)
+        self._cache_modules(ds)
+        uids = [dbdataset.new_uid() for _ in range(nslices)]
+        numbers = np.arange(n + 1, n + 1 + nslices)
+        relpaths = [os.path.join('dbdicom', dbdataset.new_uid() + '.dcm') 
+                    for _ in range(nslices)]
+        values = [None] * nslices
+        added = self._added_columns()
+
+        def write(item):
+            i, image, affine, values[i] = item
+            sl = dbdataset.copy_slice(ds, values[i].keys())
+            dbdataset.set_pixel_data(sl, image)
+            dbdataset.set_affine(sl, affine, multislice)
+            sl.SOPInstanceUID = uids[i]
+            sl.file_meta.MediaStorageSOPInstanceUID = uids[i]
+            sl.InstanceNumber = int(numbers[i])
+            if values[i]:
+                dbdataset.set_values(sl, list(values[i].keys()), list(values[i].values()))
+            dbdataset.write(sl, os.path.join(self.path, relpaths[i]))
+            return i, dbdataset.get_values(sl, added)
+
+        rows = parallel.map_iter(write, slices, workers, 'Writing volume..', nslices)
+        rows = [row for _, row in sorted(rows, key=lambda r: r[0])]
+
+        # The register rows share the values of the header, except 
+        # for those set on each slice.
+        columns = [c for c in self._file_columns() 
+                   if c not in ['removed', 'created', 'size', 'mtime']]
+        row = dbdataset.get_values(ds, columns)
+        df = pd.DataFrame({c: [v] * nslices for c, v in zip(columns, row)}, 
+                          index=relpaths)
+        df['SOPInstanceUID'] = uids
+        df['InstanceNumber'] = numbers
+        for c in values[0] if nslices > 0 else []:
+            if c in df.columns:
+                df[c] = [v[c] for v in values]
+        for j, c in enumerate(added):
+            df[c] = [row[j] for row in rows]
+        self._append_to_register(df)
 
 
     def _update_register(self, new_instances:dict):
         # A new instances to the register
-        df = pd.DataFrame.from_dict(new_instances, orient='index', columns=self.register.columns)
-        df['removed'] = False
-        df['created'] = True
-        self.register = pd.concat([self.register, df])
+        df = pd.DataFrame.from_dict(new_instances, orient='index', columns=self._file_columns())
+        self._append_to_register(df)
 
 
-    def _register_file(self):
-        filename = os.path.basename(os.path.normpath(self.path)) + ".pkl"
-        return os.path.join(self.path, filename) 
-    
+    def _file_columns(self):
+        # Register columns, excluding the extra columns read on demand
+        return [c for c in self.register.columns if c not in self._extra_columns]
 
-    def _multiframe_to_singleframe(self):
-        """Converts all multiframe files in the folder into single-frame files.
+
+    def _added_columns(self):
+        # Columns added with add_columns()
+        current = getattr(self, 'register', None)
+        if current is None:
+            return []
+        default = register.COLUMNS + [
+            'removed', 'created', 'size', 'mtime', 'NumberOfFrames', 'SOPClassUID']
+        return [c for c in self._file_columns() if c not in default]
+
+
+    def _append_to_register(self, df:pd.DataFrame):
+        # Add rows for new files to the register
+        df['removed'] = False
+        df['created'] = True
+        files = [os.path.join(self.path, f) for f in df.index]
+        df['size'], df['mtime'] = filetools.fingerprint(files)
+        tree = self._hierarchy
+        self.register = register.concat(self.register, df)
+        self._uncache(df.index)
+        if tree is not None:
+            self._hierarchy = register.add_to_tree(tree, df)
+
+
+    def _files(self, index):
+        # Paths of the files with given register indices, once for 
+        # all frames of a multi-frame file.
+        files = dict.fromkeys(register.split_key(i)[0] for i in index)
+        return [os.path.join(self.path, f) for f in files]
+
+
+    def _uncache(self, relpaths):
+        # Remove files from the caches
+        if self.cache is not None:
+            self.cache.discard(relpaths)
+        if self.disk_cache is not None:
+            series = self.register.loc[relpaths, 'SeriesInstanceUID']
+            self.disk_cache.discard(series.dropna().unique())
+
+
+    def _disk_cache_key(self, series, *args):
+        # Cache entries are grouped by series, and keyed to the files 
+        # in the series and their size and modification time
+        tree = self._tree()
+        index = register.index(self.register, series, tree)
+        fp = self.register.loc[sorted(index)].reindex(columns=['size', 'mtime'])
+        key = self.disk_cache.key(
+            args, fp.index.tolist(), fp['size'].tolist(), fp['mtime'].tolist())
+        return register.uid(self.register, series, tree), key
+
+
+    def _tree(self):
+        # Patient -> Study -> Series tree of the register. If the 
+        # register is not loaded, only the columns of the tree are read.
+        if self._hierarchy is None:
+            if self._unloaded is not None:
+                df = store.read(self._unloaded, register.TREE)
+            else:
+                df = self.register
+            self._hierarchy = register.build_tree(df)
+        return self._hierarchy
+
+    def _select(self, where):
+        # UIDs of the entities with files that meet a condition, or 
+        # None if there is no condition. If the register is not loaded, 
+        # the files are selected by an indexed query. Columns read by 
+        # unique() only hold values for some files and can not be used.
+        if not where:
+            return None
+        for c in where:
+            if c in self._extra_columns:
+                raise ValueError(
+                    f"{c} is not a register column. "
+                    "Use add_columns() to add it to the register.")
+        if self._unloaded is None:
+            return register.select(self.register, where)
+        df = store.read(self._unloaded, register.UIDS + ['removed'], where)
+        return register.select(df)
+
+
+    def _read_files(self, files, size, mtime, workers=1):
+        # Read the register entries of a list of files. Files that 
+        # are not DICOM images are remembered as skipped.
+        df = dbdataset.read_dataframe(
+            files, 
+            register.COLUMNS + self._added_columns() + ['NumberOfFrames','SOPClassUID'], 
+            path=self.path, 
+            images_only = True,
+            workers = workers)
+        df['removed'] = False
+        df['created'] = False
+        fp = pd.DataFrame(
+            {'size': size, 'mtime': mtime}, 
+            index=[os.path.relpath(f, self.path) for f in files])
+        df['size'] = fp.loc[df.index, 'size'].values
+        df['mtime'] = fp.loc[df.index, 'mtime'].values
+        for f, s, m in fp.drop(index=df.index).itertuples():
+            self._skipped[f] = (int(s), int(m))
+        return df
+
+
+    def _register_file(self, format=None):
+        if format is None:
+            format = self.register_format
+        filename = os.path.basename(os.path.normpath(self.path))
+        return store.filename(os.path.join(self.path, filename), format)
+    
+    def _register_files(self):
+        # Register files in all supported formats
+        return [self._register_file(format) for format in store.FORMATS]
+
+    def _cache_folder(self):
+        filename = os.path.basename(os.path.normpath(self.path))
+        return os.path.join(self.path, filename + '.cache')
+
+    def _saved_register_file(self):
+        # Saved register, preferably in the selected format
+        files = self._register_files()
+        if self.register_format is not None:
+            files = [self._register_file()] + files
+        for file in files:
+            if os.path.exists(file):
+                return file
         
-        Reads all the multi-frame files in the folder,
-        converts them to singleframe files, and delete the original multiframe file.
+    def _read_meta(self, file):
+        # Read the data saved along with the register
+        meta = store.read_meta(file)
+        self._skipped = {
+            f: tuple(fp) for f, fp in meta.get('skipped', {}).items()}
+        modules = meta.get('modules', {})
+        for level, _, attr in MODULES:
+            self._modules[level] = {
+                uid: _from_json(a, attr) for uid, a in modules.get(level, {}).items()}
+
+    def _save_register(self):
+        # Extra columns are only kept while the database is open
+        meta = {'skipped': self._skipped, 'modules': self._saved_modules()}
+        store.write(self.register[self._file_columns()], self._register_file(), 
+                    self._added_columns(), meta)
+        # Remove registers in any other format, and module attributes 
+        # saved separately by earlier versions
+        for file in self._register_files():
+            if file != self._register_file():
+                store.remove(file)
+        filename = os.path.basename(os.path.normpath(self.path))
+        store.remove(os.path.join(self.path, filename + '.modules.pkl'))
+    
+
+    def _index_frames(self, workers=1):
+        """List the frames of multiframe files in the register.
+
+        The row of each multiframe file is replaced by a row for each 
+        of its frames, with the values of the frame after flattening 
+        the functional groups. The files themselves are not changed, 
+        and their frames are decoded from the file when they are read.
         """
-        singleframe = self.register.NumberOfFrames.isnull() 
-        multiframe = singleframe == False
-        nr_multiframe = multiframe.sum()
-        if nr_multiframe != 0: 
-            for relpath in tqdm(self.register[multiframe].index.values, desc="Converting multiframe file " + relpath):
-                filepath = os.path.join(self.path, relpath)
-                singleframe_files = dcm4che.split_multiframe(filepath) 
-                if singleframe_files != []:            
-                    # add the single frame files to the dataframe
-                    df = dbdataset.read_dataframe(singleframe_files, self.register.columns, path=self.path)
-                    df['removed'] = False
-                    df['created'] = False
-                    self.register = pd.concat([self.register, df])
-                    # delete the original multiframe 
-                    os.remove(filepath)
-                # drop the file also if the conversion has failed
-                self.register.drop(index=relpath, inplace=True)
+        df = self.register
+        nframes = pd.to_numeric(df.NumberOfFrames, errors='coerce')
+        multiframe = nframes.notna().values & (
+            (nframes > 1).values | 
+            df.SOPClassUID.isin(list(dbdataset.SINGLE_FRAME_CLASS)).values)
+        relpaths = df.index[multiframe].tolist()
+        if relpaths != []:
+            columns = register.COLUMNS + self._added_columns() + ['SOPClassUID']
+
+            def read(relpath):
+                try:
+                    return _frame_values(os.path.join(self.path, relpath), columns)
+                except Exception:
+                    # Files that cannot be split are dropped
+                    return []
+
+            values = parallel.map_items(
+                read, relpaths, workers, 'Indexing multiframe files')
+            frames = []
+            for relpath, rows in zip(relpaths, values):
+                if rows == []:
+                    self._skipped[relpath] = (
+                        int(df.at[relpath, 'size']), int(df.at[relpath, 'mtime']))
+                index = [register.frame_key(relpath, i) for i in range(len(rows))]
+                frame_df = pd.DataFrame(rows, columns=columns, index=index)
+                # The frames are instances of the same file
+                for c in ['removed', 'created', 'size', 'mtime']:
+                    frame_df[c] = df.at[relpath, c]
+                frames.append(frame_df)
+            self.register = register.concat(df.drop(index=relpaths), pd.concat(frames))
         self.register.drop('NumberOfFrames', axis=1, inplace=True)
 
 
@@ -693,17 +1552,19 @@ class DataBaseDicom():
         If a series contain instances from different SOP Classes, 
         these are separated out into multiple series with identical SOP Classes.
         """
-        # For each series, check if there are multiple
-        # SOP Classes in the series and split them if yes.
-        all_series = self.series()
-        for series in tqdm(all_series, desc='Splitting series with multiple SOP Classes.'):
-            series_index = register.index(self.register, series)
-            df_series = self.register.loc[series_index]
-            sop_classes = df_series.SOPClassUID.unique()
+        # Find the series with multiple SOP Classes and split them.
+        # Rows kept from a previous read have no SOPClassUID.
+        df = self.register[self.register.removed == False]
+        nr_classes = df.groupby('SeriesInstanceUID').SOPClassUID.nunique()
+        for series_uid in tqdm(nr_classes[nr_classes > 1].index, desc='Splitting series with multiple SOP Classes.'):
+            series = register.entity(self.register, self.path, series_uid, self._tree())
+            df = self.register
+            df_series = df[(df.SeriesInstanceUID == series_uid) & (df.removed == False)]
+            sop_classes = df_series.SOPClassUID.dropna().unique()
             if len(sop_classes) > 1:
                 # For each sop_class, create a new series and move all
                 # instances of that sop_class to the new series
-                desc = series[-1] if isinstance(series, str) else series[0]
+                desc = series[-1] if isinstance(series[-1], str) else series[-1][0]
                 for i, sop_class in enumerate(sop_classes[1:]):
                     df_sop_class = df_series[df_series.SOPClassUID == sop_class]
                     relpaths = df_sop_class.index.tolist()
@@ -711,9 +1572,69 @@ class DataBaseDicom():
                     sop_class_series = series[:-1] + [desc + f' [{i+1}]']
                     self._files_to_series(sop_class_files, sop_class_series)
                     # Delete original files permanently
-                    self.register.drop(relpaths)
-                    for f in sop_class_files:
+                    self.register = self.register.drop(relpaths)
+                    for f in self._files(relpaths):
                         os.remove(f)
         self.register.drop('SOPClassUID', axis=1, inplace=True)
 
 
+def _module_tags():
+    # All attributes of the cached modules
+    return [a for _, _, attr in MODULES for a in attr]
+
+
+def _to_json(attr):
+    # DICOM JSON of a dictionary of attributes, with dates and times 
+    # as strings so it only holds JSON values
+    ds = dbdataset.set_values(Dataset(), list(attr), list(attr.values()))
+    return json.loads(json.dumps(ds.to_json_dict(), default=str))
+
+
+def _from_json(attr, tags):
+    # Dictionary of attributes from DICOM JSON
+    values = dbdataset.get_values(Dataset.from_json(attr), tags)
+    return {a: v for a, v in zip(tags, values) if v is not None}
+
+
+def _unique(values):
+    # Unique values of an array, sorted if possible, excluding None. 
+    # Returns None if there are none, and the value if there is one.
+    values = values[[v is not None for v in values]]
+    try:
+        values = list(pd.unique(values))
+    except TypeError:
+        values = _unique_unhashable(list(values))
+    if len(values) == 0:
+        return None
+    if len(values) == 1:
+        return values[0]
+    try: 
+        values.sort()
+    except:
+        pass
+    return values
+
+
+def _unique_unhashable(values):
+    # Unique values of a list with values such as lists, which are 
+    # hashed as tuples. Values that cannot be hashed that way are 
+    # compared one by one.
+    unique, seen = [], set()
+    for v in values:
+        try:
+            key = _hashable(v)
+            if key in seen:
+                continue
+            seen.add(key)
+        except TypeError:
+            if v in unique:
+                continue
+        unique.append(v)
+    return unique
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return (type(value).__name__,) + tuple(_hashable(v) for v in value)
+    hash(value)
+    return value
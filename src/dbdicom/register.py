@@ -1,4 +1,5 @@
 import os
+import numpy as np
 import pandas as pd
 
 
@@ -18,436 +19,606 @@ COLUMNS = [
 ]
 
 
-def index(df:pd.DataFrame, entity):
-    if isinstance(entity, str):
-        rows = (df.removed==False)
-    elif len(entity)==2:
-        patient_id = uid(df, entity)
-        rows = (df.PatientID==patient_id) & (df.removed==False)
-    elif len(entity)==3:
-        study_uid = uid(df, entity)
-        rows = (df.StudyInstanceUID==study_uid) & (df.removed==False)
-    elif len(entity)==4:
-        series_uid = uid(df, entity)
-        rows = (df.SeriesInstanceUID==series_uid) & (df.removed==False)
-    return df.index[rows].tolist()
-
-
-def files(df:pd.DataFrame, entity):
-    # Raises an error if the entity does not exist or has no files
-    df.sort_values(['PatientID', 'StudyInstanceUID', 'SeriesNumber', 'InstanceNumber'], inplace=True)
-    relpath = index(df, entity)
-    if relpath==[]:
-        raise ValueError(f'No files in entity {entity}')
-    if isinstance(entity, str):
-        return [os.path.join(entity, f) for f in relpath]
-    else:
-        return [os.path.join(entity[0], f) for f in relpath]
+# Columns with values that repeat over many files. In a compact 
+# register these are categoricals, so each value is stored only once.
+CATEGORICAL = [
+    'PatientID', 
+    'StudyInstanceUID', 
+    'SeriesInstanceUID', 
+    'PatientName', 
+    'StudyDescription', 
+    'StudyDate', 
+    'SeriesDescription', 
+]
 
 
-def _prep(df:pd.DataFrame):
-    df = df[df.removed == False]
-    df.sort_values(['PatientID','StudyInstanceUID','SeriesNumber'], inplace=True)
-    return df
+# Identifiers of patients, studies and series
+UIDS = ['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID']
 
 
-def entity(df, path, uid):# information entity from uid
-    df = _prep(df)
+# Columns needed to build the tree
+TREE = [
+    'removed', 
+    'PatientID', 'PatientName', 
+    'StudyInstanceUID', 'StudyDescription', 
+    'SeriesInstanceUID', 'SeriesDescription', 'SeriesNumber', 
+    'InstanceNumber',
+]
 
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        patient_desc = (patient_name, patient_idx[patient_name])
-        if uid == uid_patient:
-            return [path, patient_desc]
-        
-        else:
 
-            study_idx = {}
-            for uid_study in df_patient.StudyInstanceUID.dropna().unique():
-                df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-                study_name = df_study.StudyDescription.values[0]
-                if study_name in study_idx:
-                    study_idx[study_name] += 1
-                else:
-                    study_idx[study_name] = 0
-                study_desc = (study_name, study_idx[study_name])
-                if uid == uid_study:
-                    return [path, patient_desc, study_desc]
-                
-                else:
-
-                    series_idx = {}
-                    for uid_series in df_study.SeriesInstanceUID.dropna().unique():
-                        df_series = df_study[df_study.SeriesInstanceUID == uid_series]
-                        series_name = df_series.SeriesDescription.values[0]
-                        if series_name in series_idx:
-                            series_idx[series_name] += 1
-                        else:
-                            series_idx[series_name] = 0
-                        series_desc = (series_name, series_idx[series_name])
-                        if uid == uid_series:
-                            return [path, patient_desc, study_desc, series_desc]
-                        
-    raise ValueError(f"No information entity with UID {uid} was found.")
+# Frames of multi-frame files are listed in the register as separate 
+# rows, indexed by the path of the file with the frame index appended.
+FRAME = '#frame'
 
 
-def uid(df, entity): # uid from entity
-    df = df[df.removed == False]
-    if len(entity)==2:
-        return _patient_uid(df, entity)
-    if len(entity)==3:
-        return _study_uid(df, entity)
-    if len(entity)==4:
-        return _series_uid(df, entity)
+def frame_key(file, frame):
+    """Register index of a frame of a multi-frame file"""
+    return f'{file}{FRAME}{frame}'
 
 
-def _patient_uid(df, patient):
-    patient = patient[1]
-    df = df[df.removed == False]
-    patients = {}
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        patient_desc = (patient_name, patient_idx[patient_name])
-        if patient == patient_desc:
-            return uid_patient
-        patients[patient_desc] = uid_patient
-    if isinstance(patient, str):
-        patient_list = [p for p in patients.keys() if p[0]==patient]
-        if len(patient_list) == 1:
-            return patients[(patient, 0)]
-        elif len(patient_list) > 1:
-            raise ValueError(
-                f"Multiple patients with name {patient}."
-                f"Please specify the index in the call to patient_uid(). "
-                f"For instance ({patient}, {len(patients)-1})'. "
-            )
-    raise ValueError(f"Patient {patient} not found in database.")
-    
+def split_key(key):
+    """File and frame of a register index, or of a path built from it.
 
-def _study_uid(df, study):
-    uid_patient = _patient_uid(df, study[:-1])
-    patient, study = study[1], study[2]
-    df = df[df.removed == False] # TODO_manager must do this before passing df
-    df_patient = df[df.PatientID == uid_patient]
-    studies = {}
-    study_idx = {}
-    for uid_study in df_patient.StudyInstanceUID.dropna().unique():
-        df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-        study_desc = df_study.StudyDescription.values[0]
-        if study_desc in study_idx:
-            study_idx[study_desc] += 1
-        else:
-            study_idx[study_desc] = 0
-        study_desc = (study_desc, study_idx[study_desc])
-        if study == study_desc:
-            return uid_study
-        studies[study_desc] = uid_study
-    if isinstance(study, str):
-        studies_list = [s for s in studies.keys() if s[0]==study]
-        if len(studies_list) == 1:
-            return studies[(study, 0)]
-        elif len(studies_list) > 1:
-            raise ValueError(
-                f"Multiple studies with name {study}."
-                f"Please specify the index in the call to study_uid(). "
-                f"For instance ({study}, {len(studies)-1})'. "
-            )
-    raise ValueError(f"Study {study} not found in patient {patient}.")
+    The frame is None if the index refers to a single-frame file.
+    """
+    file, sep, frame = key.rpartition(FRAME)
+    if sep and frame.isdigit():
+        return file, int(frame)
+    return key, None
 
 
-def _series_uid(df, series): # absolute path to series
-    uid_study = _study_uid(df, series[:-1])
-    study, sery = series[2], series[3]
-    df = df[df.removed == False]
-    df_study = df[df.StudyInstanceUID == uid_study]
-    series = {}
-    series_idx = {}
-    for uid_series in df_study.SeriesInstanceUID.dropna().unique():
-        df_series = df_study[df_study.SeriesInstanceUID == uid_series]
-        series_desc = df_series.SeriesDescription.values[0]
-        if series_desc in series_idx:
-            series_idx[series_desc] += 1
+def compact(df:pd.DataFrame):
+    """Compact representation of a register.
+
+    Identifiers and descriptions are converted to categoricals with 
+    sorted categories, so they sort in the same order as the values, 
+    and the removed and created flags to booleans.
+    """
+    for col in CATEGORICAL:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in ['removed', 'created']:
+        if col in df.columns and df[col].dtype != bool:
+            df[col] = df[col].astype(bool)
+    return df
+
+
+def expand(df:pd.DataFrame):
+    """Convert the categoricals of a compact register back to values"""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+
+def concat(df:pd.DataFrame, new:pd.DataFrame):
+    """Append rows to a register.
+
+    Categorical columns stay categorical, with the new values added 
+    to the sorted categories.
+    """
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and col in new.columns:
+            values = pd.Index(new[col].dropna().unique())
+            categories = df[col].cat.categories.union(values)
+            if len(categories) > len(df[col].cat.categories):
+                df[col] = df[col].cat.set_categories(categories)
+            new[col] = pd.Categorical(new[col], categories=categories)
+    return pd.concat([df, new])
+
+
+def build_tree(df:pd.DataFrame):
+    """Build a Patient -> Study -> Series tree of the register.
+
+    Each node holds the UID and name of the entity, its (name, index) 
+    key, and its children in sorted order, along with a map from 
+    (name, index) keys to the UIDs of the children. Patients and 
+    studies are sorted by UID, series by SeriesNumber and UID.
+    """
+    tree = _node(None, None, None)
+    df = df[df['removed'].values == False]
+    codes = _uid_codes(df)
+    patients, studies, series = _entities(df, codes)
+    nodes = [tree]
+    for level in [patients, studies, series]:
+        # The entities are sorted so each child is added in order
+        children = []
+        parents, uids, names, k, sortkeys = level
+        for parent, uid, name, k, sortkey in zip(parents, uids, names, k.tolist(), sortkeys):
+            node = nodes[parent]
+            child = _node(uid, name, sortkey, node)
+            child['key'] = (name, k)
+            node['children'][uid] = child
+            node['keys'][child['key']] = uid
+            children.append(child)
+        nodes = children
+    _add_files(tree, df, codes)
+    return tree
+
+
+def _uid_codes(df:pd.DataFrame):
+    # Codes and unique values of the patient, study and series UIDs
+    return [pd.factorize(df[col].values, use_na_sentinel=True) for col in UIDS]
+
+
+def _entities(df:pd.DataFrame, codes=None):
+    # Patients, studies and series in the register, in sorted order. 
+    # For each level this returns the index of the parent in the level 
+    # above, and the UID, name, index among children with the same 
+    # name, and sort key of each entity. The name is taken from the 
+    # first file in sorted order.
+    if codes is None:
+        df = df[df['removed'].values == False]
+        codes = _uid_codes(df)
+
+    # One row per series, sorted by patient, study, series number and 
+    # series UID. Series without a number are sorted last. The codes 
+    # are replaced by the rank of the UIDs, as sorting the unique UIDs 
+    # is cheaper than sorting the UIDs of all files.
+    rows = ~pd.DataFrame({i: c for i, (c, _) in enumerate(codes)}).duplicated().values
+    ranks, uniques = [], []
+    for c, u in codes:
+        rank, sorted_uids = pd.factorize(u, sort=True)
+        c = c[rows]
+        ranks.append(np.append(rank, -1)[c])
+        uniques.append(np.asarray(sorted_uids, dtype=object))
+    p, st, se = ranks
+    number = pd.to_numeric(df['SeriesNumber'].values[rows], errors='coerce')
+    number = np.asarray(number, dtype=float)
+    nonum = np.isnan(number)
+    last = lambda c: np.where(c < 0, len(c), c) # missing UIDs last
+    order = np.lexsort((last(se), np.where(nonum, 0, number), nonum, last(st), last(p)))
+    order = order[p[order] >= 0]
+    p, st, se, number, nonum = p[order], st[order], se[order], number[order], nonum[order]
+    names = {
+        col: df[col][rows].to_numpy(dtype=object)[order] for col in 
+        ['PatientName', 'StudyDescription', 'SeriesDescription']
+    }
+
+    # Patients
+    first = _first(p)
+    patients = (
+        np.zeros(first.size, dtype=int), uniques[0][p[first]], 
+        names['PatientName'][first], 
+        _cumcount([names['PatientName'][first]]),
+        [(uid,) for uid in uniques[0][p[first]]],
+    )
+
+    # Studies
+    rows = st >= 0
+    first = _first(p[rows], st[rows])
+    study_rows = np.flatnonzero(rows)[first]
+    parent = np.searchsorted(np.unique(p), p[study_rows])
+    study_names = names['StudyDescription'][study_rows]
+    studies = (
+        parent, uniques[1][st[study_rows]], study_names, 
+        _cumcount([parent, study_names]),
+        [(uid,) for uid in uniques[1][st[study_rows]]],
+    )
+
+    # Series
+    rows = np.flatnonzero(rows & (se >= 0))
+    parent = np.searchsorted(study_rows, rows, side='right') - 1
+    series_names = names['SeriesDescription'][rows]
+    series_uids = uniques[2][se[rows]]
+    series = (
+        parent, series_uids, series_names, 
+        _cumcount([parent, series_names]),
+        [(True, 0, uid) if nn else (False, nr, uid) for nr, nn, uid in 
+         zip(number[rows].tolist(), nonum[rows].tolist(), series_uids)],
+    )
+    return patients, studies, series
+
+
+def _first(*codes):
+    # Positions where the value of any of the sorted codes changes
+    changed = np.zeros(codes[0].size, dtype=bool)
+    changed[:1] = True
+    for c in codes:
+        changed[1:] |= c[1:] != c[:-1]
+    return np.flatnonzero(changed)
+
+
+def _cumcount(columns):
+    # Number of earlier rows with the same values in all columns
+    if len(columns[-1]) == 0:
+        return np.zeros(0, dtype=int)
+    df = pd.DataFrame({i: pd.Series(c, dtype=object) for i, c in enumerate(columns)})
+    return df.groupby(list(df.columns), dropna=False, sort=False).cumcount().values
+
+
+def add_to_tree(tree, df:pd.DataFrame):
+    """Add the entities in a set of register rows to the tree"""
+    df = df[df['removed'].values == False]
+    files = df
+    cols = [
+        'PatientID', 'PatientName', 
+        'StudyInstanceUID', 'StudyDescription', 
+        'SeriesInstanceUID', 'SeriesDescription', 'SeriesNumber',
+    ]
+    # One row per series, in sorted order. The first row in each 
+    # group holds the name of the entity.
+    df = df.drop_duplicates(['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID'])
+    df = df.sort_values(['PatientID', 'StudyInstanceUID', 'SeriesNumber', 'SeriesInstanceUID'])
+    changed = {}
+    for pid, pname, stuid, stdesc, seuid, sedesc, senr in df[cols].itertuples(index=False):
+        if pd.isna(pid):
+            continue
+        patient = _child(tree, pid, pname, (pid,), changed)
+        if pd.isna(stuid):
+            continue
+        study = _child(patient, stuid, stdesc, (stuid,), changed)
+        if pd.isna(seuid):
+            continue
+        _child(study, seuid, sedesc, _series_sortkey(senr, seuid), changed)
+    for node in changed.values():
+        _sort(node)
+    _add_files(tree, files)
+    return tree
+
+
+def _add_files(tree, df:pd.DataFrame, codes=None):
+    # Add the files to the lowest node they belong to, which is their 
+    # series unless they have missing UIDs. The files of each node are 
+    # kept in order of InstanceNumber so files() does not need to sort.
+    if codes is None:
+        df = df[df['removed'].values == False]
+        codes = _uid_codes(df)
+    if df.empty:
+        return
+    numbers = pd.to_numeric(df['InstanceNumber'], errors='coerce')
+    numbers = np.asarray(numbers, dtype=float)
+    labels = df.index.to_numpy(dtype=object)
+    uids = [np.asarray(u, dtype=object) for _, u in codes]
+    codes = [c for c, _ in codes]
+
+    # Sort the files by series and InstanceNumber, and split by series
+    order = np.lexsort((numbers, codes[2], codes[1], codes[0]))
+    c = np.stack([ci[order] for ci in codes])
+    start = np.flatnonzero(np.r_[True, np.any(c[:, 1:] != c[:, :-1], axis=0)])
+    end = np.r_[start[1:], order.size]
+    for first, last in zip(start.tolist(), end.tolist()):
+        node = tree
+        for ci, u in zip(c[:, first].tolist(), uids):
+            if ci < 0 or u[ci] not in node['children']:
+                break
+            node = node['children'][u[ci]]
+        rows = order[first:last]
+        if node['files'].size == 0:
+            node['files'], node['numbers'] = labels[rows], numbers[rows]
         else:
-            series_idx[series_desc] = 0
-        series_desc = (series_desc, series_idx[series_desc])
-        if sery == series_desc:
-            return uid_series
-        series[series_desc] = uid_series
-    if isinstance(sery, str):
-        series_list = [s for s in series.keys() if s[0]==sery]
-        if len(series_list) == 1:
-            return series[(sery, 0)]
-        elif len(series_list) > 1:
+            files = np.concatenate([node['files'], labels[rows]])
+            numbers_node = np.concatenate([node['numbers'], numbers[rows]])
+            merged = np.argsort(numbers_node, kind='stable')
+            node['files'], node['numbers'] = files[merged], numbers_node[merged]
+
+
+def _node_files(node):
+    # All files in a node, with those of the children first
+    files = [_node_files(c) for c in node['children'].values()]
+    return np.concatenate(files + [node['files']])
+
+
+def remove_from_tree(tree, entity):
+    """Remove an entity from the tree"""
+    if isinstance(entity, str):
+        tree['children'] = {}
+        tree['keys'] = {}
+        return tree
+    node = _find(tree, entity)
+    parent = node['parent']
+    del parent['children'][node['uid']]
+    _sort(parent)
+    # Parents without children are no longer in the register
+    if parent['children'] == {} and parent['parent'] is not None:
+        remove_from_tree(tree, entity[:-1])
+    return tree
+
+
+# Shared by all nodes without files. They are replaced, not modified, 
+# when files are added.
+_NO_FILES = np.empty(0, dtype=object)
+_NO_NUMBERS = np.empty(0)
+
+
+def _node(uid, name, sortkey, parent=None):
+    return {
+        'uid': uid, 
+        'name': name, 
+        'key': None,
+        'sortkey': sortkey, 
+        'parent': parent, 
+        'children': {}, # uid: node
+        'keys': {}, # (name, index): uid
+        'files': _NO_FILES, # files not in a child
+        'numbers': _NO_NUMBERS, # InstanceNumber of the files
+    }
+
+
+def _child(node, uid, name, sortkey, changed):
+    # Return the child with a given UID - create it if needed
+    if uid not in node['children']:
+        node['children'][uid] = _node(uid, name, sortkey, node)
+        changed[id(node)] = node
+    return node['children'][uid]
+
+
+def _series_sortkey(number, uid):
+    # Series without a number are sorted last
+    if number is None or pd.isna(number):
+        return (True, 0, uid)
+    return (False, number, uid)
+
+
+def _sort(node):
+    # Sort the children and assign (name, index) keys
+    children = sorted(node['children'].values(), key=lambda c: c['sortkey'])
+    node['children'] = {c['uid']: c for c in children}
+    node['keys'] = {}
+    count = {}
+    for c in children:
+        k = count.get(c['name'], 0)
+        count[c['name']] = k + 1
+        c['key'] = (c['name'], k)
+        node['keys'][c['key']] = c['uid']
+
+
+def _find(tree, entity):
+    # Find the node of an entity in the tree
+    node = tree
+    for level, key in enumerate(entity[1:]):
+        node = node['children'][_child_uid(node, key, level, entity)]
+    return node
+
+
+def _child_uid(node, key, level, entity):
+    # UID of the child with key (name, index) or name
+
+    name = ['Patient', 'Study', 'Series'][level]
+    parent = '' if level==0 else f" in {entity[level]}"
+    if key in node['keys']:
+        return node['keys'][key]
+    if isinstance(key, str):
+        matches = [k for k in node['keys'] if k[0]==key]
+        if len(matches) == 1:
+            return node['keys'][(key, 0)]
+        elif len(matches) > 1:
             raise ValueError(
-                f"Multiple series with name {sery}."
-                f"Please specify the index in the call to series_uid(). "
-                f"For instance ({sery}, {len(series)-1})'. "
+                f"Multiple {name.lower()} entities with name {key}{parent}. "
+                f"Please specify the index. "
+                f"For instance ({key}, {len(matches)-1})."
             )
-    raise ValueError(f"Series {sery} not found in study {study}.")
+    raise ValueError(f"{name} {key} not found{parent}.")
 
 
-def patients(df, database, name=None, contains=None, isin=None):
-    df = _prep(df)
-    simplified_patients = []
-    patients = []
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        patients.append((patient_name, patient_idx[patient_name]))
-    for patient in patients:
-        if patient_idx[patient[0]] == 0:
-            simplified_patients.append(patient[0])
-        else:
-            simplified_patients.append(patient)
+def _simplified(node):
+    # Keys of the children, replaced by the name when that is unique
+    count = {}
+    for name, _ in node['keys']:
+        count[name] = count.get(name, 0) + 1
+    return [k[0] if count[k[0]] == 1 and isinstance(k[0], str) else k for k in node['keys']]
+
+
+def select(df:pd.DataFrame, where=None):
+    """UIDs of the entities with files that meet a condition.
+
+    Files that are marked as removed are not included.
+
+    Args:
+        df (pandas.DataFrame): the register, or the columns of it 
+            that are needed.
+        where (dict, optional): only include files where the columns 
+            in the keys have one of the values in the values. Values 
+            can be single values or lists. Defaults to None (all files).
+
+    Returns:
+        dict: the set of patient, study and series UIDs, with the 
+        names of the UID columns as keys.
+    """
+    rows = df['removed'].values == False
+    for c, values in (where or {}).items():
+        if c not in df.columns:
+            raise ValueError(
+                f"{c} is not a register column. "
+                "Use add_columns() to add it to the register.")
+        if not isinstance(values, (list, tuple, set, np.ndarray)):
+            values = [values]
+        rows &= df[c].isin(list(values)).values
+    return {c: set(df[c].values[rows]) for c in UIDS}
+
+
+def _selected(node, column, selected=None):
+    # Simplified keys of the children with UIDs in a selection 
+    # returned by select()
+    keys = _simplified(node)
+    if selected is None:
+        return keys
+    uids = selected[column]
+    return [k for k, key in zip(keys, node['keys']) if node['keys'][key] in uids]
+
+
+def _filter(keys, name=None, contains=None, isin=None):
+    names = [k if isinstance(k, str) else k[0] for k in keys]
     if name is not None:
-        patients_result = []
-        for s in simplified_patients:
-            if isinstance(s, str):
-                if s == name:
-                    patients_result.append(s)
-            elif s[0] == name: 
-                patients_result.append(s)
-        return [[path, p] for p in patients_result]
+        return [k for k, n in zip(keys, names) if n == name]
     elif contains is not None:
-        patients_result = []
-        for s in simplified_patients:
-            if isinstance(s, str):
-                if contains in s:
-                    patients_result.append(s)
-            elif contains in s[0]: 
-                patients_result.append(s)
-        return [[database, p] for p in patients_result]
+        return [k for k, n in zip(keys, names) if n is not None and contains in n]
     elif isin is not None:
-        patients_result = []
-        for s in simplified_patients:
-            if isinstance(s, str):
-                if s in isin:
-                    patients_result.append(s)
-            elif s[0] in isin: 
-                patients_result.append(s)
-        return [[database, p] for p in patients_result]
+        return [k for k, n in zip(keys, names) if n in isin]
     else:
-        return [[database, p] for p in simplified_patients]
+        return keys
 
 
-def studies(df, pat, name=None, contains=None, isin=None):
-    database, patient = pat[0], pat[1]
-    patient_as_str = isinstance(patient, str)
-    if patient_as_str:
-        patient = (patient, 0)
-    df = _prep(df)
-    simplified_studies = []
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        if patient[0] == patient_name:
-            if patient_as_str:
-                if patient_idx[patient_name] > 0:
-                    raise ValueError(
-                        f"Multiple patients named {patient_name}. "
-                        "Please provide an index along with the patient name."
-                    )
-        if patient == (patient_name, patient_idx[patient_name]):
-            studies = []
-            study_idx = {}
-            for uid_study in df_patient.StudyInstanceUID.dropna().unique():
-                df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-                study_desc = df_study.StudyDescription.values[0]
-                if study_desc in study_idx:
-                    study_idx[study_desc] += 1
-                else:
-                    study_idx[study_desc] = 0
-                studies.append((study_desc, study_idx[study_desc]))
-            for study in studies:
-                if study_idx[study[0]] == 0:
-                    simplified_studies.append(study[0])
-                else:
-                    simplified_studies.append(study)
-            if not patient_as_str:
-                break
-    if name is not None:    
-        studies_result = []
-        for s in simplified_studies:
-            if isinstance(s, str):
-                if s == name:
-                    studies_result.append(s)
-            elif s[0] == name: 
-                studies_result.append(s)
-        return [[database, patient, study] for study in studies_result]
-    elif contains is not None:
-        studies_result = []
-        for s in simplified_studies:
-            if isinstance(s, str):
-                if contains in s:
-                    studies_result.append(s)
-            elif contains in s[0]: 
-                studies_result.append(s)
-        return [[database, patient, study] for study in studies_result]
-    elif isin is not None:
-        studies_result = []
-        for s in simplified_studies:
-            if isinstance(s, str):
-                if s in isin:
-                    studies_result.append(s)
-            elif s[0] in isin: 
-                studies_result.append(s)
-        return [[database, patient, study] for study in studies_result]
+def _as_key(key, node, name):
+    # Convert a name to a (name, 0) key - checking it is unique
+    if not isinstance(key, str):
+        return key
+    if (key, 1) in node['keys']:
+        raise ValueError(
+            f"Multiple {name} named {key}. "
+            "Please provide an index along with the name."
+        )
+    return (key, 0)
+
+
+def index(df:pd.DataFrame, entity, tree=None):
+    # Files in the entity, ordered by series and InstanceNumber
+    if tree is None:
+        tree = build_tree(df)
+    if isinstance(entity, str):
+        node = tree
+    else:
+        node = _find(tree, entity)
+    return _node_files(node).tolist()
+
+
+def files(df:pd.DataFrame, entity, tree=None):
+    # Raises an error if the entity does not exist or has no files
+    relpath = index(df, entity, tree)
+    if relpath==[]:
+        raise ValueError(f'No files in entity {entity}')
+    if isinstance(entity, str):
+        return [os.path.join(entity, f) for f in relpath]
     else:
-        return [[database, patient, study] for study in simplified_studies]
+        return [os.path.join(entity[0], f) for f in relpath]
 
 
+def entity(df, path, uid, tree=None):# information entity from uid
+    if tree is None:
+        tree = build_tree(df)
+    for patient in tree['children'].values():
+        if uid == patient['uid']:
+            return [path, patient['key']]
+        for study in patient['children'].values():
+            if uid == study['uid']:
+                return [path, patient['key'], study['key']]
+            for series in study['children'].values():
+                if uid == series['uid']:
+                    return [path, patient['key'], study['key'], series['key']]
+    raise ValueError(f"No information entity with UID {uid} was found.")
+
+
+def max_series_number(tree, study_uid):
+    # Largest SeriesNumber in a study, or 0 if there is none
+    study = _find_uid(tree, study_uid, 1)
+    if study is None:
+        return 0
+    return _max_number([c['sortkey'][1] for c in study['children'].values() 
+                        if not c['sortkey'][0]])
+
+
+def max_instance_number(tree, series_uid):
+    # Largest InstanceNumber in a series, or 0 if there is none
+    series = _find_uid(tree, series_uid, 2)
+    return 0 if series is None else _max_number(series['numbers'])
+
+
+def _find_uid(tree, uid, depth):
+    # Node with a given UID at a depth of the tree (0 for patients, 1 
+    # for studies, 2 for series), or None if there is none
+    parents = [tree]
+    for _ in range(depth):
+        parents = [c for p in parents for c in p['children'].values()]
+    for parent in parents:
+        if uid in parent['children']:
+            return parent['children'][uid]
+    return None
+
+
+def _max_number(numbers):
+    # Missing numbers and -1 are ignored
+    n = np.asarray(numbers, dtype=float)
+    n = n[~np.isnan(n) & (n != -1)]
+    return 0 if n.size == 0 else int(np.amax(n))
+
+
+def uid(df, entity, tree=None): # uid from entity
+    if tree is None:
+        tree = build_tree(df)
+    return _find(tree, entity)['uid']
+
+
+def patients(df, database, name=None, contains=None, isin=None, tree=None, selected=None):
+    if tree is None:
+        tree = build_tree(df)
+    keys = _selected(tree, 'PatientID', selected)
+    patients = _filter(keys, name, contains, isin)
+    return [[database, p] for p in patients]
 
-def series(df, stdy, name=None, contains=None, isin=None):
+
+def studies(df, pat, name=None, contains=None, isin=None, tree=None, selected=None):
+    if tree is None:
+        tree = build_tree(df)
+    database, patient = pat[0], pat[1]
+    patient = _as_key(patient, tree, 'patients')
+    if patient not in tree['keys']:
+        return []
+    patient_node = tree['children'][tree['keys'][patient]]
+    keys = _selected(patient_node, 'StudyInstanceUID', selected)
+    studies = _filter(keys, name, contains, isin)
+    return [[database, patient, study] for study in studies]
+
+
+def series(df, stdy, name=None, contains=None, isin=None, tree=None, selected=None):
+    if tree is None:
+        tree = build_tree(df)
     database, patient, study = stdy[0], stdy[1], stdy[2]
-    patient_as_str = isinstance(patient, str)
-    if patient_as_str:
-        patient = (patient, 0)
-    study_as_str = isinstance(study, str)
-    if study_as_str:
-        study = (study, 0)
-    df = _prep(df)
-    simplified_series = []
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        if patient[0] == patient_name:
-            if patient_as_str:
-                if patient_idx[patient_name] > 0:
-                    raise ValueError(
-                        f"Multiple patients named {patient_name}. Please provide an index along with the patient name."
-                    )
-        if patient == (patient_name, patient_idx[patient_name]):
-            study_idx = {}
-            for uid_study in df_patient.StudyInstanceUID.dropna().unique():
-                df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-                study_desc = df_study.StudyDescription.values[0]
-                if study_desc in study_idx:
-                    study_idx[study_desc] += 1
-                else:
-                    study_idx[study_desc] = 0
-                if study[0] == study_desc:
-                    if study_as_str:
-                        if study_idx[study_desc] > 0:
-                            raise ValueError(
-                                f"Multiple studies named {study_desc} in patient {patient_name}. Please provide an index along with the study description."
-                            )
-                if study == (study_desc, study_idx[study_desc]):
-                    series = []
-                    series_idx = {}
-                    for uid_sery in df_study.SeriesInstanceUID.dropna().unique():
-                        df_series = df_study[df_study.SeriesInstanceUID == uid_sery]
-                        series_desc = df_series.SeriesDescription.values[0]
-                        if series_desc in series_idx:
-                            series_idx[series_desc] += 1
-                        else:
-                            series_idx[series_desc] = 0
-                        series.append((series_desc, series_idx[series_desc]))
-                    for sery in series:
-                        if series_idx[sery[0]] == 0:
-                            simplified_series.append(sery[0])
-                        else:
-                            simplified_series.append(sery)
-                    if not (patient_as_str or study_as_str):
-                        break
-    if name is not None:    
-        series_result = []
-        for s in simplified_series:
-            if isinstance(s, str):
-                if s == name:
-                    series_result.append(s)
-            elif s[0] == name: 
-                series_result.append(s)
-        return [[database, patient, study, series] for series in series_result]
-    elif contains is not None:    
-        series_result = []
-        for s in simplified_series:
-            if isinstance(s, str):
-                if contains in s:
-                    series_result.append(s)
-            elif contains in s[0]: 
-                series_result.append(s)
-        return [[database, patient, study, series] for series in series_result]
-    elif isin is not None:    
-        series_result = []
-        for s in simplified_series:
-            if isinstance(s, str):
-                if s in isin:
-                    series_result.append(s)
-            elif s[0] in isin: 
-                series_result.append(s)
-        return [[database, patient, study, series] for series in series_result]
-    else:
-        return [[database, patient, study, series] for series in simplified_series] 
+    patient = _as_key(patient, tree, 'patients')
+    if patient not in tree['keys']:
+        return []
+    patient_node = tree['children'][tree['keys'][patient]]
+    study = _as_key(study, patient_node, f'studies in patient {patient[0]}')
+    if study not in patient_node['keys']:
+        return []
+    study_node = patient_node['children'][patient_node['keys'][study]]
+    keys = _selected(study_node, 'SeriesInstanceUID', selected)
+    series = _filter(keys, name, contains, isin)
+    return [[database, patient, study, sery] for sery in series]
     
 
-def print_tree(df):
-    tree = summary(df)
+def print_tree(df, tree=None):
+    tree = summary(df, tree)
+    lines = []
     for patient, studies in tree.items():
-        print(f"Patient: ({patient[0]}, {patient[1]})")
+        lines.append(f"Patient: ({patient[0]}, {patient[1]})")
         for study, series in studies.items():
-            print(f"  Study: ({study[0]}, {study[1]})")
-            for s in series:
-                print(f"    Series: ({s[0]}, {s[1]})")
+            lines.append(f"  Study: ({study[0]}, {study[1]})")
+            lines += [f"    Series: ({s[0]}, {s[1]})" for s in series]
+    if lines:
+        print('\n'.join(lines))
 
-def append(df, parent, child_name): 
+def append(df, parent, child_name, tree=None): 
     if len(parent) == 1:
-        return _new_patient(df, parent, child_name)
+        return _new_patient(df, parent, child_name, tree)
     elif len(parent) == 2:
-        return _new_study(df, parent, child_name)
+        return _new_study(df, parent, child_name, tree)
     elif len(parent) == 3:
-        return _new_series(df, parent, child_name)
+        return _new_series(df, parent, child_name, tree)
 
-def _new_patient(df, database, patient_name):
+def _new_patient(df, database, patient_name, tree=None):
     # Count the number of series with the same description
     desc = patient_name if isinstance(patient_name, str) else patient_name[0]
-    patients_in_db = patients(df, database, name=desc)
+    patients_in_db = patients(df, database, name=desc, tree=tree)
     cnt = len(patients_in_db)
     if cnt==0:
         return [database, desc]
     else:
         return [database, (desc, cnt+1)]
     
-def _new_study(df, patient, study_name): #len(patient)=2
+def _new_study(df, patient, study_name, tree=None): #len(patient)=2
     # Count the number of series with the same description
     desc = study_name if isinstance(study_name, str) else study_name[0]
-    studies_in_patient = studies(df, patient, name=desc)
+    studies_in_patient = studies(df, patient, name=desc, tree=tree)
     cnt = len(studies_in_patient)
     if cnt==0:
         return patient + [desc]
     else:
         return patient + [(desc, cnt+1)]
     
-def _new_series(df, study, series_name): #len(study)=3
+def _new_series(df, study, series_name, tree=None): #len(study)=3
     # Count the number of series with the same description
     desc = series_name if isinstance(series_name, str) else series_name[0]
-    series_in_study = series(df, study, name=desc)
+    series_in_study = series(df, study, name=desc, tree=tree)
     cnt = len(series_in_study)
     if cnt==0:
         return study + [desc]
@@ -488,40 +659,30 @@ def uid_tree(df, path, depth=3):
     
 
 
-def summary(df):
+def summary(df, tree=None):
     # A human-readable summary tree
-
-    df = _prep(df)
+    if tree is None:
+        return _summary(df)
     summary = {}
-
-    patient_idx = {}
-    for uid_patient in df.PatientID.dropna().unique():
-        df_patient = df[df.PatientID == uid_patient]
-        patient_name = df_patient.PatientName.values[0]
-        if patient_name in patient_idx:
-            patient_idx[patient_name] += 1
-        else:
-            patient_idx[patient_name] = 0
-        summary[patient_name, patient_idx[patient_name]] = {}
-
-        study_idx = {}
-        for uid_study in df_patient.StudyInstanceUID.dropna().unique():
-            df_study = df_patient[df_patient.StudyInstanceUID == uid_study]
-            study_desc = df_study.StudyDescription.values[0]
-            if study_desc in study_idx:
-                study_idx[study_desc] += 1
-            else:
-                study_idx[study_desc] = 0
-            summary[patient_name, patient_idx[patient_name]][study_desc, study_idx[study_desc]] = []
-
-            series_idx = {}
-            for uid_sery in df_study.SeriesInstanceUID.dropna().unique():
-                df_series = df_study[df_study.SeriesInstanceUID == uid_sery]
-                series_desc = df_series.SeriesDescription.values[0]
-                if series_desc in series_idx:
-                    series_idx[series_desc] += 1
-                else:
-                    series_idx[series_desc] = 0
-                summary[patient_name, patient_idx[patient_name]][study_desc, study_idx[study_desc]].append((series_desc, series_idx[series_desc]))
-    
-    return summary
\ No newline at end of file
+    for patient in tree['children'].values():
+        summary[patient['key']] = {}
+        for study in patient['children'].values():
+            summary[patient['key']][study['key']] = [
+                series['key'] for series in study['children'].values()
+            ]
+    return summary
+
+
+def _summary(df):
+    # Summary tree built from the register, without building the 
+    # full tree of nodes.
+    patients, studies, series = _entities(df)
+    summary = [{} for _ in patients[1]]
+    keys = list(zip(patients[2], patients[3].tolist()))
+    study_series = []
+    for parent, name, k in zip(studies[0], studies[2], studies[3].tolist()):
+        study_series.append([])
+        summary[parent][(name, k)] = study_series[-1]
+    for parent, name, k in zip(series[0], series[2], series[3].tolist()):
+        study_series[parent].append((name, k))
+    return dict(zip(keys, summary))
@@ -644,23 +644,24 @@ def get_window(ds):
     return centre, width
 
 def get_pixel_array(ds):
+    """Rescaled pixel data of all frames, in (frame, column, row) order.
 
+    The rescale slope and intercept of all frames are collected first 
+    and applied to all frames at once.
+    """
     array = ds.pixel_array.astype(np.float32)
-    frames = ds.PerFrameFunctionalGroupsSequence
-    for index, frame in enumerate(frames):
-        slice = np.squeeze(array[index, ...])
-        if [0x2005, 0x100E] in ds: # 'Philips Rescale Slope'
-            slope = ds[(0x2005, 0x100E)].value
-            intercept = ds[(0x2005, 0x100D)].value
-            slice = (slice - intercept) / slope
-        else:
-            transform = frame.PixelValueTransformationSequence[0]
-            slope = float(getattr(transform, 'RescaleSlope', 1)) 
-            intercept = float(getattr(transform, 'RescaleIntercept', 0)) 
-            slice = slice * slope + intercept
-        array[index, ...] = np.transpose(slice)
-    
-    return array
+    array = array.reshape((-1,) + array.shape[-2:])
+    if [0x2005, 0x100E] in ds: # 'Philips Rescale Slope'
+        slope = ds[(0x2005, 0x100E)].value
+        intercept = ds[(0x2005, 0x100D)].value
+        array -= np.float32(intercept)
+        array /= np.float32(slope)
+    else:
+        slope = _frame_values(ds, 'PixelValueTransformationSequence', 'RescaleSlope', 1)
+        intercept = _frame_values(ds, 'PixelValueTransformationSequence', 'RescaleIntercept', 0)
+        array *= slope.astype(np.float32)[:, None, None]
+        array += intercept.astype(np.float32)[:, None, None]
+    return np.transpose(array, (0, 2, 1))
 
 
 def set_pixel_array(ds, array, value_range=None):
@@ -751,12 +752,101 @@ def signal_type(ds):
 def get_affine_matrix(ds):
     """Affine transformation matrix for all images in a multiframe image"""
 
-    affineList = []
+    affines = image.affine_matrices(
+        _frame_values(ds, 'PlaneOrientationSequence', 'ImageOrientationPatient'), 
+        _frame_values(ds, 'PlanePositionSequence', 'ImagePositionPatient'), 
+        _frame_values(ds, 'PixelMeasuresSequence', 'PixelSpacing'), 
+        _frame_values(ds, 'PixelMeasuresSequence', 'SliceThickness'))
+    return np.squeeze(affines)
+
+
+def _frame_values(ds, sequence, keyword, default=None):
+    # Values of an attribute in a functional group of each frame, as 
+    # an array with one row per frame. Frames without the group take 
+    # the value in the shared functional groups, or the default.
+    shared = default
+    if 'SharedFunctionalGroupsSequence' in ds:
+        shared = _group_value(ds.SharedFunctionalGroupsSequence[0], sequence, keyword, default)
+    values = [
+        _group_value(frame, sequence, keyword, shared) 
+        for frame in ds.PerFrameFunctionalGroupsSequence
+    ]
+    if any(v is None for v in values):
+        raise ValueError(f"{keyword} is missing in some of the frames.")
+    return np.array(values, dtype=float)
+
+
+def _group_value(group, sequence, keyword, default=None):
+    # Value of an attribute in a functional group
+    if sequence not in group or len(group[sequence].value) == 0:
+        return default
+    value = group[sequence].value[0].get(keyword)
+    return default if value is None else value
+
+
+# Functional groups that are attributes of a single-frame image as 
+# they are, rather than sequences with the attributes in one item.
+_GROUP_ATTRIBUTES = [
+    'ReferencedImageSequence', 
+    'DerivationImageSequence', 
+    'RealWorldValueMappingSequence',
+]
+
+# Attributes in functional groups that have another name in a 
+# single-frame image.
+_RENAMED = {
+    'EffectiveEchoTime': 'EchoTime',
+    'FrameType': 'ImageType',
+    'NominalCardiacTriggerDelayTime': 'TriggerTime',
+    'FrameAcquisitionDateTime': 'AcquisitionDateTime',
+}
+
+
+def frame_elements(ds):
+    """Data elements of each frame, as in a single-frame image.
+
+    The attributes in the functional groups shared by all frames and 
+    in those of each frame are listed as top-level data elements, with 
+    the values of the frame taking precedence. Private functional 
+    groups are left out.
+
+    Args:
+        ds (Dataset): multi-frame dataset.
+
+    Returns:
+        list: a list of data elements for each frame.
+    """
+    shared = {}
+    if 'SharedFunctionalGroupsSequence' in ds:
+        shared = _flatten(ds.SharedFunctionalGroupsSequence[0])
+    frames = []
     for frame in ds.PerFrameFunctionalGroupsSequence:
-        affine = image.affine_matrix(
-            frame.PlaneOrientationSequence[0].ImageOrientationPatient, 
-            frame.PlanePositionSequence[0].ImagePositionPatient, 
-            frame.PixelMeasuresSequence[0].PixelSpacing, 
-            frame.PixelMeasuresSequence[0].SliceThickness)
-        affineList.append(affine)
-    return np.squeeze(np.array(affineList))
\ No newline at end of file
+        elems = shared | _flatten(frame)
+        frames.append(list(elems.values()))
+    return frames
+
+
+def _flatten(groups):
+    # Attributes in a functional groups item, by tag
+    elems = {}
+    for group in groups:
+        if group.tag.is_private:
+            continue
+        if group.VR != 'SQ' or group.keyword in _GROUP_ATTRIBUTES:
+            elems[group.tag] = group
+            continue
+        if len(group.value) == 0:
+            continue
+        for elem in group.value[0]:
+            if elem.keyword in _RENAMED:
+                elem = _renamed(elem, _RENAMED[elem.keyword])
+            elems[elem.tag] = elem
+    return elems
+
+
+def _renamed(elem, keyword):
+    VR = pydicom.datadict.dictionary_VR(keyword)
+    value = elem.value
+    if VR == 'DS' and value is not None:
+        value = pydicom.valuerep.DSfloat(value, auto_format=True)
+    return pydicom.DataElement(pydicom.tag.Tag(keyword), VR, value)
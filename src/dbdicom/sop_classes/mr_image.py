@@ -29,6 +29,12 @@ def pixel_data(ds):
 
     array = ds.pixel_array
     array = array.astype(np.float32)
+    rescale(ds, array)
+    return np.transpose(array)
+
+
+def rescale(ds, array):
+    """Rescale a float32 array of stored pixel values in place"""
     if [0x2005, 0x100E] in ds: # 'Philips Rescale Slope'
         slope = ds[(0x2005, 0x100E)].value
         intercept = ds[(0x2005, 0x100D)].value
@@ -39,7 +45,6 @@ def pixel_data(ds):
         intercept = float(getattr(ds, 'RescaleIntercept', 0)) 
         array *= slope
         array += intercept
-    return np.transpose(array)
 
 
 def set_pixel_data(ds, array):
@@ -0,0 +1,169 @@
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+
+class LRUCache():
+    """Size-bounded cache of arrays, evicting the least recently used.
+
+    Entries are stored under a key along with a version, such as the
+    modification time of a file. Looking up a key with another version
+    is a miss, and the outdated entry is removed. The cache is thread
+    safe.
+
+    Args:
+        maxbytes (int): memory budget in bytes.
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key: (version, array)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, version=None):
+        """Return the array stored under a key, or None if there is none.
+
+        Args:
+            key: key of the entry.
+            version (optional): version of the entry. Defaults to None.
+
+        Returns:
+            numpy.ndarray: read-only array, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, array, version=None):
+        """Store a copy of an array under a key.
+
+        Arrays larger than the memory budget are not stored.
+
+        Args:
+            key: key of the entry.
+            array (numpy.ndarray): array to store.
+            version (optional): version of the entry. Defaults to None.
+        """
+        if array.nbytes > self.maxbytes:
+            return
+        array = array.copy()
+        array.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, array)
+            self.nbytes += array.nbytes
+            while self.nbytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, keys):
+        """Remove the entries with the given keys, if they are stored"""
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _remove(self, key):
+        _, array = self._entries.pop(key)
+        self.nbytes -= array.nbytes
+
+
+class DiskCache():
+    """Cache of arrays in a folder, grouped by series.
+
+    Each entry is saved as a .npy file, which is memory-mapped when it 
+    is read, along with a .npz file holding any other arrays that come 
+    with it. Entries are saved in a subfolder per group so that all 
+    entries of a group can be removed at once.
+
+    Args:
+        folder (str): folder holding the cache.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def key(self, *args):
+        """Build a key from a set of arguments with a stable repr()"""
+        return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+    def get(self, group, key):
+        """Return the array and other arrays saved under a key.
+
+        Args:
+            group (str): group of the entry.
+            key (str): key of the entry.
+
+        Returns:
+            tuple: memory-mapped array and a dictionary with the other 
+            arrays, or None if there is no entry.
+        """
+        file = os.path.join(self.folder, group, key)
+        try:
+            array = np.load(file + '.npy', mmap_mode='c')
+            with np.load(file + '.npz', allow_pickle=True) as f:
+                other = {k: f[k] for k in f.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return array, other
+
+    def put(self, group, key, array, **other):
+        """Save an array and any other arrays under a key.
+
+        Args:
+            group (str): group of the entry.
+            key (str): key of the entry.
+            array (numpy.ndarray): array to save.
+            other: other arrays to save with it.
+        """
+        folder = os.path.join(self.folder, group)
+        os.makedirs(folder, exist_ok=True)
+        file = os.path.join(folder, key)
+        # Write to temporary files and rename, so that a partial write 
+        # is never read. The .npy file is written last as get() only 
+        # finds an entry if it exists.
+        np.savez(file + '.tmp.npz', **other)
+        os.replace(file + '.tmp.npz', file + '.npz')
+        with open(file + '.tmp.npy', 'wb') as f:
+            np.save(f, array)
+        os.replace(file + '.tmp.npy', file + '.npy')
+
+    def discard(self, groups):
+        """Remove all entries of the given groups"""
+        for group in groups:
+            folder = os.path.join(self.folder, group)
+            if os.path.isdir(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+
+    def clear(self):
+        """Remove all entries"""
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
@@ -4,13 +4,21 @@ import zipfile
 
 
 
-def all_files(path):
-    files = [item.path for item in scan_tree(path) if item.is_file()]
+def all_files(path, exclude=()):
+    """All files in a folder, except those in a list of paths to exclude"""
+    files = [item.path for item in scan_tree(path, set(exclude)) if item.is_file()]
     # Windows has maximum path length of 260 - ignore any files that are longer
     if platform.system() == 'Windows':
         files = [f for f in files if len(f) <= 260]
     return files
 
+def fingerprint(files):
+    """Return the size and modification time (in ns) of a list of files"""
+    stats = [os.stat(f) for f in files]
+    size = [s.st_size for s in stats]
+    mtime = [s.st_mtime_ns for s in stats]
+    return size, mtime
+
 def export_path(basepath, folder=None):
     if folder is not None:
         # remove illegal characters
@@ -56,11 +64,13 @@ def _unzip_files(path, status):
         os.remove(file)
 
 
-def scan_tree(directory):
+def scan_tree(directory, exclude=()):
     """Helper function: yield DirEntry objects for the directory."""
 
     for entry in os.scandir(directory):
+        if entry.path in exclude:
+            continue
         if entry.is_dir(follow_symlinks=False):
-            yield from scan_tree(entry.path)
+            yield from scan_tree(entry.path, exclude)
         else:
             yield entry
\ No newline at end of file
@@ -29,6 +29,33 @@ def affine_matrix(      # single slice function
     return affine 
 
 
+def affine_matrices(
+    image_orientation,  # ImageOrientationPatient, shape (n, 6)
+    image_position,     # ImagePositionPatient, shape (n, 3)
+    pixel_spacing,      # PixelSpacing, shape (n, 2)
+    slice_thickness):   # SliceThickness, shape (n,)
+    """Affine matrices of n slices in one step, as affine_matrix()"""
+
+    image_orientation = np.asarray(image_orientation, dtype=float)
+    pixel_spacing = np.asarray(pixel_spacing, dtype=float)
+    row_cosine = image_orientation[:, :3]
+    column_cosine = image_orientation[:, 3:]
+    slice_cosine = np.cross(row_cosine, column_cosine)
+
+    # The coronal orientation has a left-handed reference frame
+    coronal = np.all(np.around(image_orientation, 3) == [1,0,0,0,0,-1], axis=1)
+    slice_cosine[coronal] *= -1
+
+    affine = np.zeros((image_orientation.shape[0], 4, 4), dtype=np.float32)
+    affine[:, :3, 0] = row_cosine * pixel_spacing[:, 1:2]
+    affine[:, :3, 1] = column_cosine * pixel_spacing[:, 0:1]
+    affine[:, :3, 2] = slice_cosine * np.asarray(slice_thickness, dtype=float)[:, None]
+    affine[:, :3, 3] = image_position
+    affine[:, 3, 3] = 1
+    
+    return affine 
+
+
 def slice_location( 
         image_orientation:list,  # ImageOrientationPatient
         image_position:list,    # ImagePositionPatient
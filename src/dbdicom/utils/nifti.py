@@ -0,0 +1,190 @@
+import os
+import gzip
+import queue
+import threading
+
+import numpy as np
+
+try:
+    import nibabel as nib
+except ImportError:
+    nib_installed = False
+else:
+    nib_installed = True
+
+
+NIFTI_IMPORT_ERROR = (
+    "Saving in NIfTI format requires the nibabel python package. You can "
+    "install it with 'pip install nibabel'."
+)
+
+# Size of a NIfTI-1 header, followed by 4 bytes flagging that there
+# are no extensions.
+VOX_OFFSET = 352
+
+
+def write(file, shape, affine, slices, dtype=np.float32):
+    """Write a NIfTI file slice by slice.
+
+    The header is written first, and then the 2D slices in the order
+    they are saved on disk, so only one slice needs to be in memory
+    at a time. Files ending in .gz are compressed in a background
+    thread, while the next slices are produced. The file is the same
+    as the one saved by vreg.write_nifti() for the same volume.
+
+    Args:
+        file (str): path to the .nii or .nii.gz file.
+        shape (tuple): shape of the data, with the two dimensions of
+            the slices first.
+        affine (numpy.ndarray): 4x4 affine of the volume, as in vreg.
+        slices (iterable): 2D arrays of shape shape[:2], ordered by
+            the third dimension first, then by the fourth, and so on.
+        dtype (numpy.dtype, optional): data type in the file. Defaults
+            to float32.
+    """
+    if not nib_installed:
+        raise ImportError(NIFTI_IMPORT_ERROR)
+    header = _header(shape, affine, dtype)
+    nslices = int(np.prod(shape[2:], dtype=int))
+    if file.endswith('.gz'):
+        # Same compression level as nibabel
+        fp = _BackgroundWriter(gzip.open(file, 'wb', compresslevel=1))
+    else:
+        fp = open(file, 'wb')
+    try:
+        fp.write(header.binaryblock + b'\x00' * (VOX_OFFSET - header.sizeof_hdr))
+        n = 0
+        for array in slices:
+            if array.shape != tuple(shape[:2]):
+                raise ValueError(
+                    f"Cannot write a slice with shape {array.shape} to a "
+                    f"volume with shape {shape}.")
+            # Slices are saved with the first index changing fastest
+            fp.write(np.asarray(array, dtype=dtype).tobytes(order='F'))
+            n += 1
+        if n != nslices:
+            raise ValueError(
+                f"Expected {nslices} slices for a volume with shape "
+                f"{shape} but received {n}.")
+    except:
+        try:
+            fp.close()
+        finally:
+            os.remove(file)
+        raise
+    fp.close()
+
+
+def read_header(file):
+    """Shape and affine of a NIfTI file, without reading the data.
+
+    Args:
+        file (str): path to the .nii or .nii.gz file.
+
+    Returns:
+        tuple: shape of the data and 4x4 affine, as in vreg.
+    """
+    if not nib_installed:
+        raise ImportError(NIFTI_IMPORT_ERROR)
+    img = nib.load(file)
+    return img.shape, _to_from_ras(img.affine)
+
+
+def read_slices(file):
+    """Generate the 2D slices of a NIfTI file in the order they are saved.
+
+    Uncompressed files are memory-mapped, and .nii.gz files are 
+    decompressed as a stream, so only one slice is read into memory 
+    at a time. The values are scaled as in vreg.read_nifti().
+
+    Args:
+        file (str): path to the .nii or .nii.gz file.
+
+    Yields:
+        numpy.ndarray: float64 array with the values of a slice, 
+        ordered by the third dimension first, then by the fourth, 
+        and so on.
+    """
+    if not nib_installed:
+        raise ImportError(NIFTI_IMPORT_ERROR)
+    # The array proxy holds the layout of the data in the file
+    proxy = nib.load(file).dataobj
+    shape, dtype, offset = proxy.shape, proxy.dtype, int(proxy.offset)
+    slope, inter = proxy.slope, proxy.inter
+    nslices = int(np.prod(shape[2:], dtype=int))
+    size = shape[0] * shape[1] * dtype.itemsize
+    if file.endswith('.gz'):
+        with gzip.open(file, 'rb') as f:
+            f.read(offset)
+            for _ in range(nslices):
+                data = f.read(size)
+                if len(data) < size:
+                    raise ValueError(f"The data in {file} are incomplete.")
+                array = np.frombuffer(data, dtype=dtype)
+                yield _scaled(array.reshape(shape[:2], order='F'), slope, inter)
+    else:
+        data = np.memmap(file, dtype=dtype, mode='r', offset=offset, 
+                         shape=shape[:2] + (nslices,), order='F')
+        for k in range(nslices):
+            yield _scaled(data[:, :, k], slope, inter)
+        del data
+
+
+def _scaled(array, slope, inter):
+    array = array.astype(np.float64)
+    array *= slope
+    array += inter
+    return array
+
+
+def _to_from_ras(affine):
+    # Convert an affine to or from the NIfTI coordinate system
+    return np.matmul(np.diag([-1, -1, 1, 1]).astype(np.float32), affine)
+
+
+def _header(shape, affine, dtype):
+    # Header as saved by nibabel for data of this shape and type. The
+    # data are a broadcast scalar, so no memory is allocated for them.
+    affine = _to_from_ras(affine)
+    data = np.broadcast_to(np.zeros((), dtype=dtype), tuple(shape))
+    header = nib.Nifti1Image(data, affine).header
+    header.set_data_offset(VOX_OFFSET)
+    header.set_slope_inter(1, 0)
+    return header
+
+
+class _BackgroundWriter():
+    # File-like object that writes to another file object in a thread.
+    # At most maxsize writes are kept waiting, so memory stays bounded
+    # if the thread cannot keep up. Errors in the thread are raised on
+    # the next write or on closing.
+
+    def __init__(self, fileobj, maxsize=4):
+        self._fileobj = fileobj
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is None:
+                try:
+                    self._fileobj.write(data)
+                except Exception as e:
+                    self._error = e
+        self._fileobj.close()
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,125 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from tqdm import tqdm
+
+
+def chunks(items, chunksize):
+    """Split a list into consecutive chunks of a given size"""
+    return [items[i:i+chunksize] for i in range(0, len(items), chunksize)]
+
+
+def map_chunks(func, items, *args, workers=1, chunksize=None,
+               processes=False, desc=None):
+    """Apply a function to chunks of a list and join the results.
+
+    Args:
+        func (callable): function taking a list of items (plus any
+            additional args) and returning a list of results. If
+            processes=True this needs to be defined at module level
+            so it can be pickled.
+        items (list): items to process.
+        args: additional arguments passed to func with each chunk.
+        workers (int, optional): number of workers. If this is 1 or
+            less, the items are processed in the calling thread.
+            Defaults to 1.
+        chunksize (int, optional): number of items in each chunk.
+            Defaults to None (about 4 chunks per worker).
+        processes (bool, optional): If True, use a process pool
+            instead of a thread pool. Defaults to False.
+        desc (str, optional): description for the progress bar. 
+            Defaults to None (no progress bar).
+
+    Returns:
+        list: the results of all chunks, in the order of the items.
+    """
+    if workers is None or workers <= 1 or len(items) <= 1:
+        return func(items, *args)
+    if chunksize is None:
+        chunksize = max(1, -(-len(items) // (4*workers)))
+    batches = chunks(items, chunksize)
+    workers = min(workers, len(batches))
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    results = []
+    with executor(max_workers=workers) as pool:
+        futures = [pool.submit(func, batch, *args) for batch in batches]
+        # Futures are collected in order so the result is deterministic
+        for future in tqdm(futures, desc=desc, disable=desc is None):
+            results += future.result()
+    return results
+
+
+
+def map_items(func, items, workers=1, desc=None, cancel=None):
+    """Apply a function to each item of a list in a thread pool.
+
+    Args:
+        func (callable): function taking a single item.
+        items (list): items to process.
+        workers (int, optional): number of threads. If this is 1 or 
+            less, the items are processed in the calling thread. 
+            Defaults to 1.
+        desc (str, optional): description for the progress bar. 
+            Defaults to None (no progress bar).
+        cancel (threading.Event, optional): If this is set, items 
+            that have not started yet are skipped. Defaults to None.
+
+    Returns:
+        list: the results, in the order of the items. The result is 
+        None for items that were skipped.
+    """
+    if cancel is not None:
+        func = _cancellable(func, cancel)
+    if workers is None or workers <= 1:
+        return [func(item) for item in tqdm(items, desc=desc, disable=desc is None)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(tqdm(pool.map(func, items), total=len(items), desc=desc, 
+                         disable=desc is None))
+
+
+def map_iter(func, items, workers=1, desc=None, total=None):
+    """Apply a function to each item of an iterable in a thread pool.
+
+    Unlike map_items(), the items are taken from the iterable in the 
+    calling thread only when a worker is about to need them, so at 
+    most twice as many items as workers are waiting at any time. This 
+    bounds the memory when the items are produced on the fly, such as 
+    slices read from a file, and produces them while the workers 
+    process the previous ones.
+
+    Args:
+        func (callable): function taking a single item.
+        items (iterable): items to process.
+        workers (int, optional): number of threads. If this is 1 or 
+            less, the items are processed in the calling thread. 
+            Defaults to 1.
+        desc (str, optional): description for the progress bar. 
+            Defaults to None (no progress bar).
+        total (int, optional): number of items, for the progress bar.
+
+    Returns:
+        list: the results, in the order of the items.
+    """
+    disable = desc is None
+    if workers is None or workers <= 1:
+        return [func(item) for item in tqdm(items, desc=desc, total=total, disable=disable)]
+    results, pending = [], deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            tqdm(total=total, desc=desc, disable=disable) as bar:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2*workers:
+                results.append(pending.popleft().result())
+                bar.update()
+        while pending:
+            results.append(pending.popleft().result())
+            bar.update()
+    return results
+
+
+def _cancellable(func, cancel):
+    def run(item):
+        if cancel.is_set():
+            return None
+        return func(item)
+    return run
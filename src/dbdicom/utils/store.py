@@ -0,0 +1,392 @@
+import os
+import json
+import pickle
+import shutil
+import sqlite3
+from contextlib import closing
+from urllib.request import pathname2url
+
+import numpy as np
+import pandas as pd
+
+
+def read(file, columns=None, where=None):
+    """Read a register from disk.
+
+    The format is detected from the file extension.
+
+    Args:
+        file (str): path to the register file.
+        columns (list, optional): columns to read. Defaults to None
+            (all columns).
+        where (dict, optional): only read the rows where the columns 
+            in the keys have one of the values in the values. Values 
+            can be single values or lists. Defaults to None (all rows).
+
+    Returns:
+        pandas.DataFrame: the register.
+    """
+    return FORMATS[format_of(file)][0](file, columns, where)
+
+
+def unique(file, column, where=None):
+    """Unique values of a column in a register on disk.
+
+    Args:
+        file (str): path to the register file.
+        column (str): column name.
+        where (dict, optional): only consider the rows where the 
+            columns in the keys have one of the values in the values. 
+            Defaults to None (all rows).
+
+    Returns:
+        list: sorted unique values, excluding missing values.
+    """
+    if format_of(file) == 'sqlite':
+        return _unique_sqlite(file, column, where)
+    values = read(file, [column], where)[column].dropna().unique()
+    return sorted(values.tolist())
+
+
+def read_meta(file):
+    """Read the metadata saved with a register.
+
+    Args:
+        file (str): path to the register file.
+
+    Returns:
+        dict: the metadata, or an empty dictionary if there are none.
+    """
+    return FORMATS[format_of(file)][3](file)
+
+
+def write(df:pd.DataFrame, file, indexed=(), meta=None):
+    """Write a register to disk.
+
+    The format is detected from the file extension.
+
+    Args:
+        df (pandas.DataFrame): the register.
+        file (str): path to the register file.
+        indexed (list, optional): columns to index in addition to the 
+            standard ones, in formats that support indexes (sqlite). 
+            Defaults to ().
+        meta (dict, optional): JSON-serialisable metadata saved in 
+            the same file as the register. Defaults to None.
+    """
+    FORMATS[format_of(file)][1](df, file, indexed, meta)
+
+
+def filename(base, format='npy'):
+    """Path of a register file in a given format"""
+    if format not in FORMATS:
+        raise ValueError(
+            f"Register format {format} is not supported. "
+            f"Choose one of {list(FORMATS)}.")
+    return base + FORMATS[format][2]
+
+
+def format_of(file):
+    """Format of a register file"""
+    for format, (_, _, ext, _) in FORMATS.items():
+        if file.endswith(ext):
+            return format
+    raise ValueError(f"{file} is not a register file.")
+
+
+def remove(file):
+    """Delete a register file"""
+    if os.path.isdir(file):
+        shutil.rmtree(file)
+    elif os.path.exists(file):
+        os.remove(file)
+
+
+# Pickle format: one file with the pickled DataFrame. Metadata are 
+# saved as JSON text in the attributes of the DataFrame.
+
+def _read_pickle(file, columns=None, where=None):
+    df = _select(pd.read_pickle(file), where)
+    df.attrs = {}
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def _read_meta_pickle(file):
+    return json.loads(pd.read_pickle(file).attrs.get(META, '{}'))
+
+
+def _write_pickle(df, file, indexed=(), meta=None):
+    df = df.copy(deep=False)
+    df.attrs = {META: json.dumps(meta or {})}
+    df.to_pickle(file)
+
+
+# Columnar format: a folder with one .npy file per column. Columns of
+# strings are saved as integer codes into a table of unique values, 
+# so that columns can be read separately and strings are not pickled. 
+# Columns are loaded into memory when they are read. Columns of other 
+# objects, such as lists, are saved pickled.
+
+def _read_npy(file, columns=None, where=None):
+    with open(os.path.join(file, 'columns.json'), 'r') as f:
+        meta = json.load(f)
+    cols = {c['name']: c for c in meta['columns']}
+    if columns is None:
+        columns = list(cols)
+    # Also read the columns needed for the selection
+    read = columns + [c for c in (where or {}) if c not in columns]
+    _check_columns(read, cols)
+    index = _read_column(file, meta['index'])
+    data = {name: _read_column(file, cols[name]) for name in read}
+    df = pd.DataFrame(data, index=pd.Index(index, name=meta['index']['name']))
+    df = _restore_dtypes(df, {c: cols[c]['dtype'] for c in read})
+    return _select(df, where)[columns]
+
+
+def _read_meta_npy(file):
+    try:
+        with open(os.path.join(file, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_npy(df, file, indexed=(), meta=None):
+    # Write to a temporary folder first so a failed write does not
+    # leave a corrupted register behind.
+    tmp = file + '.tmp'
+    remove(tmp)
+    os.makedirs(tmp)
+    columns = {
+        'index': _write_column(tmp, 'index', df.index.name, df.index),
+        'columns': [
+            _write_column(tmp, f'column_{i}', name, df[name])
+            for i, name in enumerate(df.columns)
+        ],
+    }
+    with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump(columns, f)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta or {}, f)
+    remove(file)
+    os.rename(tmp, file)
+
+
+def _write_column(folder, key, name, values):
+    col = {'name': name, 'key': key, 'dtype': str(values.dtype)}
+    if values.dtype.kind in 'biuf':
+        col['encoding'] = 'values'
+        np.save(os.path.join(folder, key + '.npy'), values.to_numpy())
+        return col
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Categoricals are saved with their own codes
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = None, values
+    if pd.api.types.infer_dtype(uniques, skipna=True) in ('string', 'empty'):
+        col['encoding'] = 'strings'
+        if codes is None:
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        # Unique strings are saved as one UTF-8 buffer, separated by
+        # null characters, which are not allowed in DICOM strings.
+        text = '\x00'.join(uniques).encode('utf-8')
+        col['uniques'] = len(uniques)
+        np.save(os.path.join(folder, key + '.codes.npy'), codes.astype(np.int32))
+        np.save(os.path.join(folder, key + '.text.npy'), np.frombuffer(text, dtype=np.uint8))
+    else:
+        col['encoding'] = 'objects'
+        np.save(os.path.join(folder, key + '.npy'),
+                values.to_numpy(dtype=object), allow_pickle=True)
+    return col
+
+
+def _read_column(folder, col):
+    key = os.path.join(folder, col['key'])
+    # The files are memory-mapped only to read the values, which are 
+    # copied so the files are not held open. Otherwise the register 
+    # cannot be overwritten on Windows.
+    if col['encoding'] == 'values':
+        return np.array(np.load(key + '.npy', mmap_mode='r'))
+    elif col['encoding'] == 'strings':
+        codes = np.load(key + '.codes.npy', mmap_mode='r')
+        text = np.load(key + '.text.npy', mmap_mode='r')
+        uniques = text.tobytes().decode('utf-8').split('\x00')
+        if col.get('uniques', codes.size) == 0:
+            uniques = []
+        if col['dtype'] == 'category':
+            return pd.Categorical.from_codes(np.array(codes), uniques)
+        # Missing values have code -1 and map to the last element.
+        uniques = np.array(uniques + [None], dtype=object)
+        return uniques[codes]
+    else:
+        return np.load(key + '.npy', allow_pickle=True)
+
+
+# SQLite format: one table with a row for each file, indexed on the 
+# columns used to look up entities. Queries only read the rows and 
+# columns they need, and multiple processes can read at the same time.
+# Columns with values that SQLite cannot hold, such as lists, are 
+# saved pickled.
+
+INDEXED = [
+    'PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 
+    'PatientName', 'StudyDescription', 'SeriesDescription',
+]
+
+
+def _read_sqlite(file, columns=None, where=None):
+    with closing(sqlite3.connect(_uri(file), uri=True)) as con:
+        index_name, dtypes = _dtypes(con)
+        if columns is None:
+            columns = list(dtypes)
+        _check_columns(columns + list(where or {}), dtypes)
+        select = ', '.join(_quote(c) for c in [INDEX] + columns)
+        sql, params = _where(where)
+        df = pd.read_sql_query(
+            f'SELECT {select} FROM register{sql} ORDER BY rowid', con, 
+            params=params, index_col=INDEX)
+    df.index.name = index_name
+    for c in columns:
+        if dtypes[c] == PICKLED:
+            df[c] = [None if v is None else pickle.loads(v) for v in df[c]]
+    return _restore_dtypes(df, {c: dtypes[c] for c in columns if dtypes[c] != PICKLED})
+
+
+def _unique_sqlite(file, column, where=None):
+    with closing(sqlite3.connect(_uri(file), uri=True)) as con:
+        _, dtypes = _dtypes(con)
+        _check_columns([column] + list(where or {}), dtypes)
+        sql, params = _where(where)
+        sql += (' AND ' if sql else ' WHERE ') + f'{_quote(column)} IS NOT NULL'
+        rows = con.execute(
+            f'SELECT DISTINCT {_quote(column)} FROM register{sql} '
+            f'ORDER BY {_quote(column)}', params).fetchall()
+    values = pd.Series([r[0] for r in rows])
+    if len(values) > 0:
+        values = values.astype(dtypes[column])
+    return values.tolist()
+
+
+def _read_meta_sqlite(file):
+    with closing(sqlite3.connect(_uri(file), uri=True)) as con:
+        try:
+            row = con.execute('SELECT json FROM meta').fetchone()
+        except sqlite3.OperationalError:
+            # Registers saved without metadata
+            return {}
+    return {} if row is None else json.loads(row[0])
+
+
+def _write_sqlite(df, file, indexed=(), meta=None):
+    # Write to a temporary file first and replace the register in one 
+    # step, so processes reading the register never see a partial write.
+    tmp = file + '.tmp'
+    remove(tmp)
+    data = df.reset_index(names=INDEX)
+    dtypes = [(INDEX, df.index.name, str(df.index.dtype))]
+    for c in df.columns:
+        if _sql_values(df[c]):
+            dtypes.append((c, c, str(df[c].dtype)))
+        else:
+            data[c] = [None if v is None else pickle.dumps(v) for v in df[c]]
+            dtypes.append((c, c, PICKLED))
+    with closing(sqlite3.connect(tmp)) as con:
+        data.to_sql('register', con, index=False)
+        con.execute('CREATE TABLE dtypes (name TEXT, label TEXT, dtype TEXT)')
+        con.executemany('INSERT INTO dtypes VALUES (?, ?, ?)', dtypes)
+        con.execute('CREATE TABLE meta (json TEXT)')
+        con.execute('INSERT INTO meta VALUES (?)', (json.dumps(meta or {}),))
+        con.execute(f'CREATE UNIQUE INDEX idx_index ON register ({_quote(INDEX)})')
+        for c in INDEXED + [c for c in indexed if c not in INDEXED]:
+            if c in df.columns:
+                con.execute(f'CREATE INDEX {_quote("idx_" + c)} ON register ({_quote(c)})')
+        con.commit()
+    os.replace(tmp, file)
+
+
+INDEX = '_index'
+PICKLED = 'pickled'
+META = 'meta'
+
+
+def _dtypes(con):
+    # Name of the index and dtypes of the columns
+    rows = con.execute('SELECT name, label, dtype FROM dtypes').fetchall()
+    index_name = [r[1] for r in rows if r[0] == INDEX][0]
+    return index_name, {r[0]: r[2] for r in rows if r[0] != INDEX}
+
+
+def _uri(file):
+    # Open read-only
+    return 'file:' + pathname2url(os.path.abspath(file)) + '?mode=ro'
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _where(where):
+    # SQL condition selecting rows with given values
+    if not where:
+        return '', []
+    sql, params = [], []
+    for column, values in where.items():
+        values = _as_list(values)
+        sql.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+        params += [_to_sql(v) for v in values]
+    return ' WHERE ' + ' AND '.join(sql), params
+
+
+def _sql_values(values):
+    # Check if a column can be saved in SQLite as it is
+    if values.dtype != object:
+        return True
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    return kind in ('string', 'integer', 'floating', 'mixed-integer-float', 
+                    'boolean', 'bytes', 'empty')
+
+
+def _to_sql(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# Helper functions
+
+def _as_list(values):
+    if isinstance(values, (list, tuple, set, np.ndarray, pd.Index, pd.Series)):
+        return list(values)
+    return [values]
+
+
+def _select(df, where):
+    if not where:
+        return df
+    rows = np.ones(len(df), dtype=bool)
+    for column, values in where.items():
+        rows &= df[column].isin(_as_list(values)).values
+    return df[rows]
+
+
+def _check_columns(columns, available):
+    for name in columns:
+        if name not in available:
+            raise ValueError(f"Column {name} is not in the register.")
+
+
+def _restore_dtypes(df, dtypes):
+    for name, dtype in dtypes.items():
+        if str(df[name].dtype) != dtype:
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+# format: (reader, writer, extension, metadata reader)
+FORMATS = {
+    'npy': (_read_npy, _write_npy, '.dbd', _read_meta_npy),
+    'pickle': (_read_pickle, _write_pickle, '.pkl', _read_meta_pickle),
+    'sqlite': (_read_sqlite, _write_sqlite, '.sqlite', _read_meta_sqlite),
+}
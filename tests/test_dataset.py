@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import numpy as np
+import pydicom
+
+import dbdicom.utils.files as filetools
+import dbdicom.dataset as dbdataset
+import dbdicom.register as register
+from dbdicom.sop_classes import enhanced_mr_image
+from dbdicom.utils import image
+
+datapath = os.path.join(os.path.dirname(__file__), 'data')
+ct = os.path.join(datapath, 'VPH-Pelvis-CT')
+mri = os.path.join(datapath, 'Leeds_iBEAt')
+skull = os.path.join(datapath, '2_skull_ct', 'DICOM')
+multiframe = os.path.join(datapath, 'MULTIFRAME')
+
+
+
+def test_read_dataframe_parallel():
+
+    files = filetools.all_files(ct)
+    tags = register.COLUMNS + ['NumberOfFrames','SOPClassUID']
+    df = dbdataset.read_dataframe(files, tags, path=ct, images_only=True)
+    for processes in [True, False]:
+        df_par = dbdataset.read_dataframe(files, tags, path=ct,
+            images_only=True, workers=4, processes=processes)
+        assert df_par.index.tolist() == df.index.tolist()
+        assert df_par.equals(df)
+
+
+def test_pixel_data():
+
+    for path in [ct, mri]:
+        for file in filetools.all_files(path)[:5]:
+            ds = dbdataset.read_dataset(file)
+            mod = dbdataset.SOPCLASSMODULE[ds.SOPClassUID]
+            array = np.transpose(ds.pixel_array).astype(np.float32)
+            getattr(mod, 'rescale', dbdataset._rescale)(ds, array)
+            # Read from the file without decoding
+            ds = dbdataset.read_dataset(file, defer_pixels=True)
+            assert dbdataset.pixel_view(ds) is not None
+            assert np.array_equal(dbdataset.pixel_data(ds), array)
+            # Into a preallocated array
+            out = np.zeros(array.shape, dtype=np.float32)
+            dbdataset.pixel_data(ds, out)
+            assert np.array_equal(out, array)
+
+
+def test_copy_file():
+
+    tmp = os.path.join(os.path.dirname(__file__), 'tmp')
+    tags = ['SOPInstanceUID', 'InstanceNumber', 'PatientName', 'SeriesDescription']
+    values = [dbdataset.new_uid(), 99, 'Copy^Patient', 'Copy']
+    for path in [ct, mri, skull]:
+        file = filetools.all_files(path)[0]
+        copy = os.path.join(tmp, 'copy.dcm')
+        dbdataset.copy_file(file, copy, tags, values)
+        ds = pydicom.dcmread(file)
+        ds_copy = pydicom.dcmread(copy)
+        assert dbdataset.get_values(ds_copy, tags) == values
+        assert ds_copy.file_meta.MediaStorageSOPInstanceUID == values[0]
+        # All other elements, including the pixel data, are the same
+        dbdataset.set_values(ds, tags, values)
+        assert set(ds_copy.keys()) == set(ds.keys())
+        for tag in ds.keys():
+            assert ds_copy[tag] == ds[tag]
+    shutil.rmtree(tmp)
+
+
+def test_split_multiframe():
+
+    tmp = os.path.join(os.path.dirname(__file__), 'tmp')
+    for file in filetools.all_files(multiframe):
+        ds = dbdataset.read_dataset(file)
+        frames = dbdataset.split_multiframe(ds)
+        assert len(frames) == ds.NumberOfFrames
+        # The frames get the same UIDs each time
+        uids = [f.SOPInstanceUID for f in dbdataset.split_multiframe(ds)]
+        assert [f.SOPInstanceUID for f in frames] == uids
+        assert len(set(uids)) == len(uids)
+        for i, frame in enumerate(frames):
+            copy = os.path.join(tmp, f'{i}.dcm')
+            dbdataset.copy_frame(frame, copy, [], [])
+            ds_frame = pydicom.dcmread(copy)
+            assert ds_frame.SOPClassUID == pydicom.uid.MRImageStorage
+            assert ds_frame.file_meta.MediaStorageSOPInstanceUID == ds_frame.SOPInstanceUID
+            assert np.array_equal(ds_frame.pixel_array, ds.pixel_array[i,...])
+            group = ds.PerFrameFunctionalGroupsSequence[i]
+            position = group.PlanePositionSequence[0].ImagePositionPatient
+            assert ds_frame.ImagePositionPatient == position
+            assert 'EchoTime' in ds_frame
+        shutil.rmtree(tmp)
+
+
+def test_enhanced_mr_frames():
+
+    for file in filetools.all_files(multiframe):
+        ds = dbdataset.read_dataset(file)
+        affines = enhanced_mr_image.get_affine_matrix(ds)
+        array = enhanced_mr_image.get_pixel_array(ds)
+        pixels = ds.pixel_array.astype(np.float32)
+        for i, frame in enumerate(ds.PerFrameFunctionalGroupsSequence):
+            affine = image.affine_matrix(
+                frame.PlaneOrientationSequence[0].ImageOrientationPatient, 
+                frame.PlanePositionSequence[0].ImagePositionPatient, 
+                frame.PixelMeasuresSequence[0].PixelSpacing, 
+                frame.PixelMeasuresSequence[0].SliceThickness)
+            assert np.array_equal(affines[i], affine)
+            transform = frame.PixelValueTransformationSequence[0]
+            slope = float(transform.RescaleSlope)
+            intercept = float(transform.RescaleIntercept)
+            assert np.allclose(array[i], (pixels[i] * slope + intercept).T)
+
+
+if __name__ == "__main__":
+
+    test_read_dataframe_parallel()
+    test_pixel_data()
+    test_copy_file()
+    test_split_multiframe()
+    test_enhanced_mr_frames()
+
+    print('-------------------------')
+    print('dataset passed all tests!')
+    print('-------------------------')
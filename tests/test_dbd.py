@@ -0,0 +1,570 @@
+import os
+import shutil
+import threading
+
+import numpy as np
+import pydicom
+import vreg
+
+import dbdicom as db
+import dbdicom.register as register
+import dbdicom.utils.store as store
+from dbdicom.utils.cache import LRUCache
+
+datapath = os.path.join(os.path.dirname(__file__), 'data')
+ct = os.path.join(datapath, 'VPH-Pelvis-CT')
+multiframe = os.path.join(datapath, 'MULTIFRAME')
+
+# Helper functions
+
+def create_tmp_database(path):
+    tmp = os.path.join(os.path.dirname(__file__), 'tmp')
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    shutil.copytree(path, tmp)
+    return tmp
+
+def remove_tmp_database(tmp):
+    shutil.rmtree(tmp)
+
+
+
+def test_incremental_read():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    dbd.close()
+    n = len(dbd.register)
+
+    # Remove a file
+    os.remove(os.path.join(tmp, 'vhf.999.dcm'))
+    dbd = db.open(tmp, refresh=True)
+    assert len(dbd.register) == n-1
+    assert 'vhf.999.dcm' not in dbd.register.index
+
+    # Files written by dbdicom are not read again
+    vol = dbd.volume(dbd.series()[0])
+    dbd.write_volume(vol, [tmp, 'Patient', 'Study', 'Series'])
+    dbd.read()
+    assert len(dbd.register) == 2*(n-1)
+    assert dbd.register.created.sum() == n-1
+    dbd.restore()
+    assert len(dbd.register) == n-1
+
+    # Files that are not images are not parsed again
+    dtypes = dbd.register.dtypes
+    with open(os.path.join(tmp, 'notes.txt'), 'w') as f:
+        f.write('Not a DICOM file')
+    dbd.read()
+    assert len(dbd.register) == n-1
+    assert dbd.register.dtypes.equals(dtypes)
+    dbd.close()
+    assert store.read(dbd._register_file()).dtypes.equals(dtypes)
+    read_dataframe = db.dataset.read_dataframe
+    db.dataset.read_dataframe = None
+    try:
+        dbd = db.open(tmp, refresh=True)
+    finally:
+        db.dataset.read_dataframe = read_dataframe
+    assert len(dbd.register) == n-1
+
+    remove_tmp_database(tmp)
+
+
+def test_tree():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    series = dbd.series()
+    study = [tmp, ('Patient', 0), ('Study', 0)]
+    dbd.copy(series[0], study + ['Series B'])
+    dbd.copy(series[0], study + ['Series A'])
+    assert dbd.series(study) == [study + ['Series B'], study + ['Series A']]
+
+    # Files are listed in order without sorting the register
+    index = dbd.register.index.copy()
+    files = register.files(dbd.register, study + ['Series A'], dbd._tree())
+    assert dbd.register.index.equals(index)
+    numbers = [pydicom.dcmread(f).InstanceNumber for f in files[:5]]
+    assert numbers == sorted(numbers)
+
+    # The tree and the summary are also built directly from the register
+    assert register.summary(dbd.register) == dbd.summary()
+    assert register.summary(dbd.register, register.build_tree(dbd.register)) == dbd.summary()
+    dbd.delete(study + ['Series B'])
+    assert dbd.series(study) == [study + ['Series A']]
+    dbd.delete(study + ['Series A'])
+    assert dbd.series(study) == []
+    assert len(dbd.patients()) == 1
+    dbd.close()
+
+    remove_tmp_database(tmp)
+
+
+def test_copy():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp, workers=4)
+    patient = dbd.patients()[0]
+    dbd.copy(patient, [tmp, 'Copy'])
+    assert len(dbd.register) == 300
+    assert [s[-1] for s in dbd.series([tmp, 'Copy'])] == ['Resampled to 1mm voxels']
+
+    # Copy to another database
+    other = os.path.join(tmp, 'other')
+    dbd.copy(patient + ['Visible Human Female'], [other, 'Patient', 'Study'])
+    assert [s[-1] for s in db.open(other).series()] == ['Resampled to 1mm voxels']
+
+    # A cancelled copy leaves the destination unchanged
+    cancel = threading.Event()
+    cancel.set()
+    dbd.copy(patient, [other, 'Patient 2'], cancel=cancel)
+    other_dbd = db.open(other)
+    assert len(other_dbd.register) == 150
+    assert len(os.listdir(os.path.join(other, 'dbdicom'))) == 150
+
+    remove_tmp_database(tmp)
+
+
+def test_register_format():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    dbd.close()
+    file = dbd._register_file()
+    assert file.endswith('.dbd')
+    df = store.read(file)
+    assert df.equals(dbd.register)
+    assert df.dtypes.equals(dbd.register.dtypes)
+    cols = store.read(file, columns=['SeriesNumber', 'removed'])
+    assert cols.columns.tolist() == ['SeriesNumber', 'removed']
+    assert cols.equals(dbd.register[['SeriesNumber', 'removed']])
+
+    # Convert to pickle format
+    dbd = db.open(tmp, register_format='pickle')
+    assert dbd.register.equals(df)
+    dbd.close()
+    assert os.path.exists(dbd._register_file())
+    assert not os.path.exists(file)
+
+    # The register is not read as DICOM data
+    dbd = db.open(tmp, refresh=True)
+    assert dbd.register.equals(df)
+
+    # Indexed queries on an SQLite register
+    dbd = db.open(tmp, register_format='sqlite')
+    dbd.close()
+    file = dbd._register_file()
+    assert store.read(file).equals(df)
+    uid = df.SeriesInstanceUID.iloc[0]
+    rows = store.read(file, ['InstanceNumber'], where={'SeriesInstanceUID': uid})
+    assert rows.equals(df.loc[df.SeriesInstanceUID == uid, ['InstanceNumber']])
+    assert store.unique(file, 'SeriesNumber') == sorted(df.SeriesNumber.unique())
+
+    # The format is kept when the database is opened with default arguments
+    db.open(tmp).close()
+    assert os.path.exists(file)
+    assert db.open(tmp).register_format == 'sqlite'
+
+    # Lookups read from the SQLite register without loading it
+    dbd = db.open(tmp)
+    series = dbd.series()
+    assert dbd.unique(['SeriesNumber'], series[0]) == {'SeriesNumber': 1}
+    assert len(dbd.unique(['InstanceNumber'], series[0])['InstanceNumber']) == 150
+    assert register.files(None, series[0], dbd._tree()) == register.files(df, series[0])
+    assert dbd._register is None
+    assert dbd.register.equals(df)
+
+    remove_tmp_database(tmp)
+
+
+def test_compact():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    dbd.close()
+    df = dbd.register
+    dbd = db.open(tmp, compact=True)
+    assert dbd.register.SeriesInstanceUID.dtype == 'category'
+    assert register.expand(dbd.register.copy()).equals(df)
+    assert dbd.summary() == register.summary(df)
+
+    # New rows stay categorical
+    series = dbd.series()[0]
+    dbd.copy(series, [tmp, 'Patient', 'Study', 'Series'])
+    assert dbd.register.SeriesInstanceUID.dtype == 'category'
+    assert len(dbd.series()) == 2
+    dbd.close()
+    assert store.read(dbd._register_file()).equals(dbd.register)
+
+    # A compact register is expanded when opened in the default mode
+    dbd = db.open(tmp)
+    assert dbd.register.SeriesInstanceUID.dtype == df.SeriesInstanceUID.dtype
+    assert len(dbd.series()) == 2
+
+    remove_tmp_database(tmp)
+
+
+def test_volume():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    vol = dbd.volume(dbd.series()[0])
+    assert vol.shape == (512, 512, 150)
+    vol4 = dbd.volume(dbd.series()[0], workers=4)
+    assert np.array_equal(vol4.values, vol.values)
+    assert np.array_equal(vol4.affine, vol.affine)
+
+    # Two volumes with different flip angles in the same series
+    series = [tmp, 'Patient', 'Study', 'Series']
+    values = np.arange(8*6*4, dtype=np.float32).reshape((8,6,4))
+    for fa in [10, 20]:
+        vol = vreg.volume(fa*values, spacing=[1,1,2])
+        dbd.write_volume(vol, series)
+    for i, f in enumerate(register.files(dbd.register, series)):
+        ds = pydicom.dcmread(f)
+        ds.FlipAngle = 10 if i < 4 else 20
+        ds.save_as(f)
+    vol = dbd.volume(series, dims='FlipAngle')
+    assert vol.shape == (8, 6, 4, 2)
+    assert vol.dims == ['FlipAngle']
+    assert np.array_equal(vol.coords[0], [10, 20])
+    assert np.allclose(vol.values[...,1], 20*values, rtol=1e-3)
+    assert np.array_equal(vol.affine, np.diag([1,1,2,1]))
+
+    remove_tmp_database(tmp)
+
+def test_write_volume():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    vol = dbd.volume(dbd.series()[0])
+    n = len(dbd.register)
+
+    # Slices are written in parallel and registered in one step
+    series = [tmp, 'Patient', 'Study', 'Series']
+    dbd.write_volume(vol, series, workers=4)
+    vol2 = dbd.volume(series)
+    assert np.allclose(vol2.values, vol.values, atol=0.1)
+    assert np.allclose(vol2.affine, vol.affine)
+    rows = dbd.register.iloc[n:]
+    assert rows.InstanceNumber.tolist() == list(range(1, 151))
+    assert rows.SOPInstanceUID.is_unique
+    assert rows.SeriesDescription.unique().tolist() == ['Series']
+
+    # Writing to the series again continues the numbering
+    dbd.write_volume(vol, series, workers=4)
+    rows = dbd.register.iloc[n+150:]
+    assert rows.InstanceNumber.tolist() == list(range(151, 301))
+
+    # Each file has its own header
+    files = register.files(dbd.register, series)
+    ds0, ds1 = pydicom.dcmread(files[0]), pydicom.dcmread(files[1])
+    assert ds0.SOPInstanceUID == ds0.file_meta.MediaStorageSOPInstanceUID
+    assert ds0.ImagePositionPatient != ds1.ImagePositionPatient
+
+    # 4D volumes are written with their coordinates
+    values = np.random.rand(8, 6, 4, 3).astype(np.float32)
+    vol = vreg.volume(values, np.diag([1,1,2,1]), [np.array([10, 20, 30])], ['FlipAngle'])
+    series = [tmp, 'Patient', 'Study', 'Series 4D']
+    dbd.write_volume(vol, series)
+    assert len(dbd.register) == n + 300 + 12
+    vol2 = dbd.volume(series, dims='FlipAngle')
+    assert np.array_equal(vol2.coords[0], [10, 20, 30])
+    assert np.allclose(vol2.values, values, atol=1e-3)
+
+    remove_tmp_database(tmp)
+
+def test_module_attributes():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    series = dbd.series()[0]
+    uid = register.uid(dbd.register, series)
+    ds = pydicom.dcmread(register.files(dbd.register, series)[0])
+    assert dbd._modules['series'][uid]['Modality'] == ds.Modality
+
+    # Derived series are created without reading the source files
+    read_header = db.dataset.read_header
+    db.dataset.read_header = None
+    try:
+        vol = vreg.volume(np.zeros((8, 6, 4)))
+        dbd.write_volume(vol, series[:3] + ['Derived'])
+        dbd.copy(series, series[:3] + ['Copy'])
+    finally:
+        db.dataset.read_header = read_header
+    attr = dbd._attributes(series[:3] + ['Derived'])
+    assert attr['StudyInstanceUID'] == ds.StudyInstanceUID
+    assert attr['Modality'] == 'MR'
+    dbd.close()
+
+    # The attributes are saved with the register
+    assert store.read_meta(dbd._register_file())['modules']['series'][uid] is not None
+    assert not [f for f in os.listdir(tmp) if f.endswith('.modules.pkl')]
+    dbd = db.open(tmp)
+    assert dbd._modules['series'][uid]['Modality'] == ds.Modality
+    assert dbd._modules['study'][ds.StudyInstanceUID]['StudyDate'] == str(ds.StudyDate)
+    assert len(dbd._modules['series']) == 3
+
+    remove_tmp_database(tmp)
+
+
+def test_unique():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    series = dbd.series()[0]
+    assert dbd.unique(['SeriesNumber'], series) == {'SeriesNumber': 1}
+
+    # Attributes outside the register are read once and kept
+    values = dbd.unique(['SliceLocation', 'ImageType'], series)
+    assert len(values['SliceLocation']) == 150
+    assert values['ImageType'] == ['ORIGINAL', 'PRIMARY', 'AXIAL']
+    assert 'SliceLocation' in dbd.register.columns
+    read_dataframe = db.dataset.read_dataframe
+    db.dataset.read_dataframe = None
+    try:
+        assert dbd.unique(['SliceLocation', 'ImageType'], series) == values
+    finally:
+        db.dataset.read_dataframe = read_dataframe
+
+    # New files are read when needed, and extra columns are not saved
+    dbd.copy(series, [tmp, 'Patient', 'Study', 'Series'])
+    values = dbd.unique(['ImageType'], [tmp, 'Patient'])
+    assert values['ImageType'] == ['ORIGINAL', 'PRIMARY', 'AXIAL']
+    dbd.close()
+    assert 'SliceLocation' not in store.read(dbd._register_file()).columns
+
+    # Columns read by unique() can not be used to select entities, 
+    # as they are only read for some of the files
+    dbd = db.open(tmp)
+    dbd.unique(['SliceThickness'], series)
+    dbd.copy(series, [tmp, 'Patient', 'Study', 'Series 2'])
+    try:
+        dbd.series(where={'SliceThickness': 1.0})
+    except ValueError as e:
+        assert 'add_columns()' in str(e)
+    else:
+        assert False
+
+    remove_tmp_database(tmp)
+
+
+def test_add_columns():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp, register_format='sqlite')
+    series = dbd.series()[0]
+    dbd.add_columns(['SliceThickness', 'ImageType'])
+    assert dbd.series(where={'SliceThickness': 1.0}) == [series]
+    assert dbd.series(where={'SliceThickness': 2.5}) == []
+
+    # Added columns are kept up to date on writes
+    vol = vreg.volume(np.zeros((8, 6, 4)), spacing=[1, 1, 2.5])
+    dbd.write_volume(vol, [tmp, 'Patient', 'Study', 'Series'])
+    assert dbd.series(where={'SliceThickness': 2.5}) == [[tmp, ('Patient', 0), ('Study', 0), 'Series']]
+    assert len(dbd.studies(where={'SliceThickness': [1.0, 2.5]})) == 2
+
+    # and saved with the register
+    dbd.close()
+    df = store.read(dbd._register_file())
+    assert df.equals(dbd.register)
+    assert df.ImageType.iloc[0] == ['ORIGINAL', 'PRIMARY', 'AXIAL']
+    dbd = db.open(tmp)
+    assert dbd.patients(where={'SliceThickness': 2.5}) == [[tmp, 'Patient']]
+    assert dbd.series(where={'SliceThickness': 1.0}) == [series]
+    assert dbd._register is None
+
+    remove_tmp_database(tmp)
+
+
+def test_cache():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp, cache=10**9)
+    series = dbd.series()[0]
+    vol = dbd.volume(series)
+    assert (dbd.cache.hits, dbd.cache.misses) == (0, 150)
+    assert dbd.cache.nbytes == vol.values.nbytes
+    # Slices are cached by path relative to the database
+    assert all(f in dbd.cache for f in dbd.register.index)
+    vol2 = dbd.volume(series)
+    assert (dbd.cache.hits, dbd.cache.misses) == (150, 150)
+    assert np.array_equal(vol2.values, vol.values)
+    array, _ = dbd.pixel_data(series, 'SliceLocation')
+    assert dbd.cache.hits == 300
+    assert np.array_equal(array, vol.values)
+
+    # Deleted files are removed from the cache
+    dbd.delete(series)
+    assert len(dbd.cache) == 0
+
+    # Only the most recent slices are kept
+    dbd.restore()
+    dbd.cache = LRUCache(vol.values.nbytes // 2)
+    dbd.volume(series)
+    assert len(dbd.cache) == 75
+    dbd.volume(series)
+    assert dbd.cache.hits == 0
+
+    remove_tmp_database(tmp)
+
+def test_disk_cache():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp, disk_cache=True)
+    series = dbd.series()[0]
+    vol = dbd.volume(series)
+    vol2 = dbd.volume(series)
+    assert isinstance(vol2.values, np.memmap)
+    assert np.array_equal(vol2.values, vol.values)
+    assert np.array_equal(vol2.affine, vol.affine)
+    array, coords, values = dbd.pixel_data(series, 'InstanceNumber', include='SliceLocation')
+    array2, coords2, values2 = dbd.pixel_data(series, 'InstanceNumber', include='SliceLocation')
+    assert isinstance(array2, np.memmap)
+    assert np.array_equal(array2, array)
+    assert np.array_equal(coords2, coords)
+    assert np.array_equal(values2, values)
+
+    # The cache is not scanned as part of the database
+    dbd.read()
+    assert len(dbd.register) == 150
+
+    # Changes to the series invalidate the cache
+    folder = os.path.join(dbd.disk_cache.folder, register.uid(dbd.register, series))
+    assert os.path.isdir(folder)
+    dbd.write_volume(vol, series)
+    assert not os.path.isdir(folder)
+    dbd.restore()
+    dbd.volume(series)
+    assert os.path.isdir(folder)
+    dbd.delete(series)
+    assert not os.path.isdir(folder)
+    dbd.close()
+
+    remove_tmp_database(tmp)
+
+
+def test_multiframe():
+
+    tmp = create_tmp_database(multiframe)
+    dbd = db.open(tmp)
+    assert len(dbd.register) == 124
+    assert 'NumberOfFrames' not in dbd.register.columns
+    series = dbd.series()
+    assert len(series) == 2
+    files = [register.files(dbd.register, s) for s in series]
+    assert sorted(len(f) for f in files) == [20, 104]
+    vol = dbd.volume([s for s, f in zip(series, files) if len(f) == 20][0])
+    assert vol.shape == (256, 256, 20)
+
+    # The files are not changed and the frames are listed again
+    assert sorted(os.listdir(tmp)) == ['IM_0010', 'IM_0014']
+    uids = dbd.register.SOPInstanceUID.copy()
+    dbd.read(full=True)
+    assert len(dbd.register) == 124
+    # Each frame has its own UID, which is the same on every read
+    assert dbd.register.SOPInstanceUID.is_unique
+    assert dbd.register.SOPInstanceUID.equals(uids)
+    dbd.close()
+    assert len(db.open(tmp).register) == 124
+
+    # Frames are copied to single-frame files
+    series = [s for s, f in zip(series, files) if len(f) == 20][0]
+    copy = series[:-1] + ['Copy']
+    dbd.copy(series, copy)
+    assert len(register.files(dbd.register, copy)) == 20
+    vol_copy = dbd.volume(copy)
+    assert np.array_equal(vol_copy.values, vol.values)
+    assert np.array_equal(vol_copy.affine, vol.affine)
+
+    remove_tmp_database(tmp)
+
+
+def test_to_nifti():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    series = dbd.series()[0]
+    vol = dbd.volume(series)
+    ref = os.path.join(tmp, 'ref.nii')
+    vreg.write_nifti(vol, ref)
+
+    # The streamed file is the same as the one saved from the volume
+    file = os.path.join(tmp, 'series.nii')
+    dbd.to_nifti(series, file, workers=4)
+    with open(file, 'rb') as f, open(ref, 'rb') as f_ref:
+        assert f.read() == f_ref.read()
+    dbd.to_nifti(series, file + '.gz')
+    vol2 = vreg.read_nifti(file + '.gz')
+    assert np.array_equal(vol2.values, vreg.read_nifti(ref).values)
+
+    # 4D volumes
+    values = np.random.rand(8, 6, 4, 3).astype(np.float32)
+    vol = vreg.volume(values, np.diag([1,1,2,1]), [np.array([10, 20, 30])], ['FlipAngle'])
+    series = [tmp, 'Patient', 'Study', 'Series 4D']
+    dbd.write_volume(vol, series)
+    dbd.to_nifti(series, file, dims='FlipAngle')
+    vreg.write_nifti(dbd.volume(series, dims='FlipAngle'), ref)
+    with open(file, 'rb') as f, open(ref, 'rb') as f_ref:
+        assert f.read() == f_ref.read()
+
+    remove_tmp_database(tmp)
+
+
+def test_from_nifti():
+
+    tmp = create_tmp_database(ct)
+    dbd = db.open(tmp)
+    file = os.path.join(tmp, 'volume.nii')
+    vol = vreg.volume(np.random.rand(8, 6, 4).astype(np.float32), np.diag([1,1,2,1]))
+    vreg.write_nifti(vol, file)
+    dbd.from_nifti(file, [tmp, 'Patient', 'Study', 'Series'])
+    vol2 = dbd.volume([tmp, 'Patient', 'Study', 'Series'])
+    assert np.allclose(vol2.values, vol.values, atol=1e-3)
+    assert np.array_equal(vol2.affine, vol.affine)
+
+    # Compressed 4D files, with the same slices as write_volume()
+    values = np.random.rand(8, 6, 4, 3).astype(np.float32)
+    coords = [np.array([10, 20, 30])]
+    vol = vreg.volume(values, np.diag([1,1,2,1]), coords, ['FlipAngle'])
+    vreg.write_nifti(vol, file + '.gz')
+    series = [tmp, 'Patient', 'Study', 'Series 4D']
+    dbd.from_nifti(file + '.gz', series, dims=['FlipAngle'], coords=coords, workers=4)
+    vol2 = dbd.volume(series, dims='FlipAngle')
+    assert np.array_equal(vol2.coords[0], [10, 20, 30])
+    assert np.allclose(vol2.values, values, atol=1e-3)
+    copy = [tmp, 'Patient', 'Study', 'Copy 4D']
+    dbd.write_volume(vol, copy)
+    files = register.files(dbd.register, series)
+    copy_files = register.files(dbd.register, copy)
+    for f, f_copy in zip(files, copy_files):
+        ds, ds_copy = pydicom.dcmread(f), pydicom.dcmread(f_copy)
+        assert ds.InstanceNumber == ds_copy.InstanceNumber
+        assert ds.FlipAngle == ds_copy.FlipAngle
+        assert ds.ImagePositionPatient == ds_copy.ImagePositionPatient
+
+    remove_tmp_database(tmp)
+
+
+if __name__ == "__main__":
+
+    test_incremental_read()
+    test_tree()
+    test_copy()
+    test_register_format()
+    test_compact()
+    test_volume()
+    test_write_volume()
+    test_module_attributes()
+    test_unique()
+    test_add_columns()
+    test_cache()
+    test_disk_cache()
+    test_multiframe()
+    test_to_nifti()
+    test_from_nifti()
+
+    print('-------------------------')
+    print('dbdicom passed all tests!')
+    print('-------------------------')